@@ -0,0 +1,97 @@
+from threading import Event, Thread
+
+from botocore.exceptions import ClientError
+
+# The error codes that the various AWS services use to signal that requests are being throttled.
+_THROTTLING_ERRORS = {
+    "Throttling",
+    "ThrottlingException",
+    "ThrottledException",
+    "RequestLimitExceeded",
+    "RequestThrottled",
+    "RequestThrottledException",
+    "TooManyRequestsException",
+    "ProvisionedThroughputExceededException"
+}
+
+
+def is_throttling_error(e: ClientError):
+    return e.response.get("Error", {}).get("Code") in _THROTTLING_ERRORS
+
+
+# Calls `poll` on its own thread, at an interval that adapts to how often the result changes, and puts each result,
+# along with the poller's name, on `queue`. The interval starts at `min_interval` and, each time the result is the
+# same as the previous one, it grows until it reaches `max_interval`. As soon as the result changes, it drops back to
+# `min_interval`. While the poller is urgent, e.g. while instances are booting or the job is nearly done, the interval
+# stays at `min_interval` (see `set_urgent`).
+#
+# botocore already retries throttled requests a few times. If a request still fails due to throttling, the poller
+# backs off exponentially, up to `_MAX_BACKOFF`, rather than adding to the problem. If `poll` fails in any other way,
+# the exception is put on `queue` in place of a result and the poller stops.
+class AdaptivePoller:
+    _GROWTH = 1.5
+    _MAX_BACKOFF = 300
+
+    def __init__(self, name, poll, queue, min_interval, max_interval):
+        self._name = name
+        self._poll = poll
+        self._queue = queue
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._interval = min_interval
+        self._backoff = 0
+        self._previous = None
+        self._stopped = Event()
+        self._woken = Event()
+        self._thread = Thread(target=self._run, daemon=True)
+        self._urgent = False
+
+    def _next_interval(self, result):
+        if self._urgent or result != self._previous:
+            self._interval = self._min_interval
+        else:
+            self._interval = min(self._interval * self._GROWTH, self._max_interval)
+        self._previous = result
+        return self._interval
+
+    def _on_throttled(self, e):
+        self._backoff = min(max(self._backoff * 2, self._interval), self._MAX_BACKOFF)
+        code = e.response["Error"]["Code"]
+        print(f"Polling {self._name} is being throttled ({code}) - retrying in {self._backoff:.0f}s")
+        return self._backoff
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._woken.clear()
+            try:
+                result = self._poll()
+            except ClientError as e:
+                if not is_throttling_error(e):
+                    self._queue.put((self._name, e))
+                    return
+                interval = self._on_throttled(e)
+            except Exception as e:
+                self._queue.put((self._name, e))
+                return
+            else:
+                self._backoff = 0
+                self._queue.put((self._name, result))
+                interval = self._next_interval(result)
+            self._woken.wait(interval)
+
+    def start(self):
+        self._thread.start()
+
+    # Polls again straight away, e.g. after terminating instances, rather than waiting for the current interval.
+    def wake(self):
+        self._woken.set()
+
+    def set_urgent(self, urgent):
+        if urgent and not self._urgent:
+            self.wake()
+        self._urgent = urgent
+
+    def stop(self):
+        self._stopped.set()
+        self._woken.set()
+        self._thread.join()
@@ -0,0 +1,47 @@
+import json
+import os
+from functools import lru_cache
+from pathlib import Path
+
+from utils import hash_file
+
+# A local cache of information, e.g. scene attributes, about .blend files. Entries are keyed by the absolute path of
+# the .blend file and are only used while the file's content is unchanged, i.e. while its hash is the same.
+_CACHE_FILE = "blend_cache.json"
+
+
+# Hashing a big .blend file takes a while, so the hash is only recalculated if the file's size or mtime changes.
+@lru_cache
+def _hash_blend_file(path, size, mtime_ns):
+    return hash_file(path)
+
+
+def hash_blend_file(blend_file):
+    path = os.path.abspath(blend_file)
+    stat = os.stat(path)
+    return _hash_blend_file(path, stat.st_size, stat.st_mtime_ns)
+
+
+def _read_cache():
+    path = Path(_CACHE_FILE)
+    return json.loads(path.read_text()) if path.is_file() else {}
+
+
+# Returns `None` if nothing is cached under `name` for the current content of the .blend file.
+def get_cached(blend_file, name):
+    entry = _read_cache().get(os.path.abspath(blend_file))
+    if entry is None or entry["hash"] != hash_blend_file(blend_file):
+        return None
+    return entry.get(name)
+
+
+def set_cached(blend_file, name, value):
+    cache = _read_cache()
+    path = os.path.abspath(blend_file)
+    blend_hash = hash_blend_file(blend_file)
+    entry = cache.get(path)
+    if entry is None or entry["hash"] != blend_hash:
+        entry = {"hash": blend_hash}
+        cache[path] = entry
+    entry[name] = value
+    Path(_CACHE_FILE).write_text(json.dumps(cache, indent=2))
@@ -0,0 +1,78 @@
+import gzip
+import struct
+import sys
+
+from blend_cache import get_cached, set_cached
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Reads the frame range of each scene straight from a .blend file, without starting Blender, in the same way as
+# Blender's own `blend_render_info.py`. Blender writes a "REND" block, holding the start frame, end frame and name,
+# for each scene at the very start of the file, so only the first few blocks need to be read.
+
+_GZIP_MAGIC = b"\x1f\x8b"
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+_REND_CODE = b"REND"
+_SCENE_NAME_LENGTH = 64
+
+
+# .blend files can be saved uncompressed or, depending on the Blender version, gzip or zstd compressed.
+def _open(blend_file):
+    with open(blend_file, "rb") as f:
+        magic = f.read(len(_ZSTD_MAGIC))
+    if magic.startswith(_GZIP_MAGIC):
+        return gzip.open(blend_file, "rb")
+    if magic == _ZSTD_MAGIC:
+        if zstandard is None:
+            raise RuntimeError(f"{blend_file} is zstd compressed - install the zstandard package to read it")
+        return zstandard.ZstdDecompressor().stream_reader(open(blend_file, "rb"), closefd=True)
+    return open(blend_file, "rb")
+
+
+def _read_scenes(blend_file):
+    with _open(blend_file) as f:
+        header = f.read(12)
+        if not header.startswith(b"BLENDER"):
+            raise RuntimeError(f"{blend_file} is not a .blend file")
+        pointer_format = "Q" if header[7:8] == b"-" else "I"
+        endian = "<" if header[8:9] == b"v" else ">"
+        # The block code, the length of the block's data, its old memory address, SDNA index and count.
+        block_header = struct.Struct(f"{endian}4si{pointer_format}ii")
+        frames = struct.Struct(f"{endian}2i")
+
+        scenes = []
+        while True:
+            data = f.read(block_header.size)
+            if len(data) < block_header.size:
+                raise RuntimeError(f"{blend_file} is truncated")
+            code, length, _, _, _ = block_header.unpack(data)
+            if code != _REND_CODE:
+                # The "REND" blocks are all written before any other block.
+                return scenes
+            content = f.read(length)
+            frame_start, frame_end = frames.unpack_from(content)
+            name = content[frames.size:frames.size + _SCENE_NAME_LENGTH].split(b"\0", 1)[0].decode(errors="replace")
+            scenes.append({"name": name, "frame_start": frame_start, "frame_end": frame_end})
+
+
+# Returns a list of dicts, one for each scene, with the scene's name, start frame and end frame. The result is cached
+# by the file's hash, so the file is only read again if it changes.
+def get_scenes(blend_file):
+    scenes = get_cached(blend_file, "scenes")
+    if scenes is None:
+        scenes = _read_scenes(blend_file)
+        set_cached(blend_file, "scenes", scenes)
+    return scenes
+
+
+def main():
+    for scene in get_scenes(sys.argv[1]):
+        print(f"{scene['name']}: frames {scene['frame_start']} to {scene['frame_end']}")
+
+
+if __name__ == "__main__":
+    main()
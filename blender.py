@@ -1,3 +1,4 @@
+import os
 import subprocess
 import sys
 import textwrap
@@ -10,8 +11,10 @@ _END_MARKER = "<END"
 _MATCHER = re.compile(f"{_START_MARKER}(.*){_END_MARKER}")
 
 
+# The output is flushed straight away - when stdout is a pipe, e.g. for a persistent Blender process (see
+# `start_blender`), Python buffers it and the caller could wait forever for a dict that's stuck in the buffer.
 def dump_dict(name):
-    return f"""import json; print(f"{_START_MARKER}{{json.dumps({name})}}{_END_MARKER}")"""
+    return f"""import json; print(f"{_START_MARKER}{{json.dumps({name})}}{_END_MARKER}", flush=True)"""
 
 
 def recover_dict(completed: subprocess.CompletedProcess):
@@ -19,27 +22,67 @@ def recover_dict(completed: subprocess.CompletedProcess):
     return json.loads(json_str)
 
 
+# Returns `None` if the line doesn't contain a dict dumped with `dump_dict`.
+def recover_dict_from_line(line):
+    match = _MATCHER.search(line)
+    return json.loads(match.group(1)) if match is not None else None
+
+
+def _get_popenargs(blender, input_file, python_code, additional_popenargs):
+    python_code = textwrap.dedent(python_code)
+    # If you put `--python-expr` before the input file then you'll get values from the default cube scene.
+    # If there's no input file, the default cube scene is all you get.
+    return [
+        blender,
+        "--factory-startup",
+        "--background"
+    ] + ([input_file] if input_file is not None else []) + [
+        "--python-expr", python_code
+    ] + (additional_popenargs if additional_popenargs is not None else [])
+
+
+# If `cwd` isn't set then Blender can't find resources with relative paths.
+def _get_cwd(input_file):
+    if input_file is None:
+        return None
+    return Path(input_file).parent  # Surprisingly, os.path.dirname("foo") returns "" rather than "."
+
+
+# `env` holds just the environment variables to be added to the current environment, e.g. `CUDA_VISIBLE_DEVICES`.
+def _get_env(env):
+    return {**os.environ, **env} if env is not None else None
+
+
+# Start Blender without waiting for it to complete. Its stdin and stdout are pipes, so the Python code can
+# communicate with the caller.
+def start_blender(blender, input_file, python_code, additional_popenargs=None, env=None) -> subprocess.Popen:
+    popenargs = _get_popenargs(blender, input_file, python_code, additional_popenargs)
+    return subprocess.Popen(
+        popenargs,
+        cwd=_get_cwd(input_file),
+        env=_get_env(env),
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        text=True,
+        bufsize=1  # Line buffered.
+    )
+
+
 # `capture_output` can also be used as a semi-silent mode - output will only be printed if CalledProcessError occurs.
 def run_blender(
     blender,
     input_file,
     python_code,
     additional_popenargs=None,
-    capture_output=False
+    capture_output=False,
+    env=None
 ) -> subprocess.CompletedProcess:
-    python_code = textwrap.dedent(python_code)
-    # If you put `--python-expr` before the input file then you'll get values from the default cube scene.
-    # And if `cwd` isn't set then Blender can't find resources with relative paths.
-    popenargs = [
-        blender,
-        "--factory-startup",
-        "--background",
-        input_file,
-        "--python-expr", python_code
-    ] + (additional_popenargs if additional_popenargs is not None else [])
-    cwd = Path(input_file).parent  # Surprisingly, os.path.dirname("foo") returns "" rather than "."
+    popenargs = _get_popenargs(blender, input_file, python_code, additional_popenargs)
+    cwd = _get_cwd(input_file)
     try:
-        return subprocess.run(popenargs, cwd=cwd, check=True, capture_output=capture_output, text=True)
+        return subprocess.run(
+            popenargs, cwd=cwd, env=_get_env(env), check=True, capture_output=capture_output, text=True
+        )
     except subprocess.CalledProcessError as e:
         if capture_output:
             print(e.stdout)
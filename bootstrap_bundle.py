@@ -0,0 +1,92 @@
+import hashlib
+import os
+import subprocess
+import sys
+import tarfile
+from tempfile import TemporaryDirectory
+
+from boto_basics import BotoBasics, get_s3_uri
+from config import get_config
+from utils import sizeof_fmt
+
+# The Python packages needed by the workers. They're all pure Python, so they can be installed here, for the
+# worker's version of Python, and simply be put on the worker's `PYTHONPATH`.
+_REQUIREMENTS = ["boto3", "boto3-stubs[essential,logs]"]
+
+_PLATFORM = "manylinux2014_x86_64"
+
+# The bundle unpacks to these directories in the worker's job directory.
+_BLENDER_DIR = "blender"
+_SITE_PACKAGES_DIR = "site-packages"
+
+# gzip decompresses several times faster than xz and, at this level, the bundle is not much bigger than at level 9.
+_COMPRESS_LEVEL = 6
+
+
+# The version changes whenever the Blender archive or the requirements do, so a bundle only has to be built once.
+def _get_version(archive_etag, python_version):
+    content = "\n".join([archive_etag, python_version] + _REQUIREMENTS)
+    return hashlib.sha256(content.encode()).hexdigest()[:12]
+
+
+def _install_requirements(target, python_version):
+    subprocess.run([
+        sys.executable, "-m", "pip", "install",
+        "--quiet",
+        "--target", target,
+        "--python-version", python_version,
+        "--platform", _PLATFORM,
+        "--only-binary=:all:",
+    ] + _REQUIREMENTS, check=True)
+
+
+# Repack the Blender archive, with its top-level directory renamed, and the packages into a single archive.
+def _create_bundle(blender_archive, site_packages, bundle_file):
+    with tarfile.open(blender_archive) as src, tarfile.open(bundle_file, "w:gz", compresslevel=_COMPRESS_LEVEL) as dst:
+        for member in src:
+            file = src.extractfile(member) if member.isfile() else None
+            member.name = "/".join([_BLENDER_DIR] + member.name.split("/")[1:])
+            if member.islnk():
+                member.linkname = "/".join([_BLENDER_DIR] + member.linkname.split("/")[1:])
+            dst.addfile(member, file)
+        dst.add(site_packages, _SITE_PACKAGES_DIR)
+
+
+# Returns the name of the bootstrap bundle, in the file store, for the given Blender archive. The bundle is built,
+# and uploaded, if it doesn't already exist.
+def get_bootstrap_bundle(basics: BotoBasics, file_store, blender_archive, python_version):
+    store = basics.get_bucket(file_store[5:])
+    archive = store.Object(blender_archive)
+    name = f"bootstrap-{_get_version(archive.e_tag, python_version)}.tar.gz"
+    bundle = store.Object(name)
+    if basics.object_exists(bundle):
+        print(f"Using bootstrap bundle {get_s3_uri(bundle)}")
+        return name
+
+    print(f"Building bootstrap bundle {get_s3_uri(bundle)}...")
+    with TemporaryDirectory() as tmp:
+        archive_file = f"{tmp}/{blender_archive}"
+        site_packages = f"{tmp}/{_SITE_PACKAGES_DIR}"
+        bundle_file = f"{tmp}/{name}"
+        archive.download_file(archive_file)
+        _install_requirements(site_packages, python_version)
+        _create_bundle(archive_file, site_packages, bundle_file)
+        bundle.upload_file(bundle_file)
+        print(f"Uploaded bootstrap bundle ({sizeof_fmt(os.path.getsize(bundle_file))})")
+
+    return name
+
+
+# The bundle is built automatically by `run_manager.py` but it can also be built in advance.
+def main():
+    config = get_config("settings.ini")
+    get_bootstrap_bundle(
+        BotoBasics(),
+        config.get("file_store"),
+        config.get("blender_archive"),
+        config.get("worker_python_version")
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,5 @@
+from collections import Counter
+from threading import Lock
 from typing import List, Optional, Dict
 
 import boto3
@@ -13,7 +15,12 @@ from mypy_boto3_s3 import S3Client
 from mypy_boto3_s3.service_resource import S3ServiceResource, Object
 from mypy_boto3_s3.type_defs import CreateBucketConfigurationTypeDef
 from mypy_boto3_dynamodb.service_resource import DynamoDBServiceResource, Table
-from mypy_boto3_dynamodb.type_defs import AttributeDefinitionTypeDef, KeySchemaElementTypeDef
+from mypy_boto3_dynamodb.type_defs import (
+    AttributeDefinitionTypeDef,
+    KeySchemaElementTypeDef,
+    GlobalSecondaryIndexTypeDef,
+    ProjectionTypeDef,
+)
 from mypy_boto3_logs import CloudWatchLogsClient
 
 from ec2_metadata import get_region
@@ -43,6 +50,15 @@ def create_attribute_definition(name, attr_type):
     return AttributeDefinitionTypeDef(AttributeName=name, AttributeType=attr_type)
 
 
+# With "KEYS_ONLY", an index just holds the table's key attributes and the index's own key attributes.
+def create_global_secondary_index(name, schema, projection_type="KEYS_ONLY"):
+    return GlobalSecondaryIndexTypeDef(
+        IndexName=name,
+        KeySchema=schema,
+        Projection=ProjectionTypeDef(ProjectionType=projection_type)
+    )
+
+
 # These "s3://..." URIs just seem to be an aws-cli thing - they're not used in boto.
 def get_s3_uri(item):
     name = type(item).__name__
@@ -54,6 +70,16 @@ def get_s3_uri(item):
         raise RuntimeError(f"unexpected type {type(item)}")
 
 
+# Formats the counts returned by `BotoBasics.get_all_api_calls`, grouped by service, with the busiest services first.
+def format_api_calls(calls: Counter):
+    by_service = {}
+    for (service, op), count in sorted(calls.items(), key=lambda item: item[1], reverse=True):
+        if count > 0:
+            by_service.setdefault(service, {})[op] = count
+    services = sorted(by_service.items(), key=lambda item: sum(item[1].values()), reverse=True)
+    return ", ".join(f"{service} {ops}" for service, ops in services)
+
+
 # Report all EC2 instances that are not in terminated state.
 def report_non_terminated_instances(basics):
     states = list(_INSTANCE_STATES)
@@ -62,13 +88,34 @@ def report_non_terminated_instances(basics):
     print(f"There are currently {non_terminated} non-terminated EC2 instances")
 
 
-class BotoBasics:
+# Counts API calls, per service and operation. It can be shared by several `BotoBasics`, e.g. ones used on different
+# threads, so that their calls are counted together.
+class ApiCallCounter:
     def __init__(self):
+        self._calls = Counter()
+        self._lock = Lock()
+
+    def add(self, service_name, op):
+        with self._lock:
+            self._calls[(service_name, op)] += 1
+
+    def get_all(self) -> Counter:
+        with self._lock:
+            return Counter(self._calls)
+
+
+class BotoBasics:
+    # If `api_calls` is provided, calls are counted there rather than by a counter of this instance's own.
+    def __init__(self, api_calls: Optional[ApiCallCounter] = None):
         self._botocore_session = botocore.session.get_session()
         self._set_region(self._botocore_session)
 
         self._session = boto3.session.Session(botocore_session=self._botocore_session)
 
+        # Count every API call made via this session, e.g. to see how many DynamoDB calls claiming a frame costs.
+        self.api_calls = api_calls if api_calls is not None else ApiCallCounter()
+        self._botocore_session.register("before-call", self._count_api_call)
+
         # As of Boto3 1.23.8, the default `defaults_mode` is still `legacy`.
         # See https://docs.aws.amazon.com/sdkref/latest/guide/feature-smart-config-defaults.html
         # noinspection PyArgumentList
@@ -90,6 +137,18 @@ class BotoBasics:
         if region is None:
             botocore_session.set_config_variable("region", get_region())
 
+    def _count_api_call(self, model, **_):
+        self.api_calls.add(model.service_model.service_name, model.name)
+
+    # Returns the number of calls made so far, per operation, for the given service, e.g. "dynamodb".
+    def get_api_calls(self, service_name) -> Dict[str, int]:
+        calls = self.api_calls.get_all()
+        return {op: count for (service, op), count in calls.items() if service == service_name}
+
+    # Returns the number of calls made so far, per service and operation, e.g. `("dynamodb", "Query")`.
+    def get_all_api_calls(self) -> Counter:
+        return self.api_calls.get_all()
+
     def _get_or_create_client(self, field, name):
         return field if field is not None else self._session.client(name, config=self._config)
 
@@ -123,9 +182,12 @@ class BotoBasics:
         min_count=None,
         min_factor=0.5,
         shutdown_behavior="terminate",
-        spot=False
+        spot=False,
+        availability_zone=None
     ) -> List[Instance]:
         kwargs = {}
+        if availability_zone is not None:
+            kwargs["Placement"] = {"AvailabilityZone": availability_zone}
         if key_name is not None:
             kwargs["KeyName"] = key_name
         if iam_instance_profile is not None:
@@ -183,6 +245,7 @@ class BotoBasics:
     def describe_instance_status(self, instance_ids) -> List[dict]:
         return self._get_ec2_client().describe_instance_status(InstanceIds=instance_ids)["InstanceStatuses"]
 
+    # If `availability_zone` is `None`, the history for all availability zones is returned.
     def describe_spot_price_history(
         self,
         instance_type,
@@ -194,9 +257,10 @@ class BotoBasics:
         kwargs = {}
         if end_time is not None:
             kwargs["EndTime"] = end_time
+        if availability_zone is not None:
+            kwargs["AvailabilityZone"] = availability_zone
         return self._get_ec2_client().describe_spot_price_history(
             InstanceTypes=[instance_type],
-            AvailabilityZone=availability_zone,
             StartTime=start_time,
             ProductDescriptions=[product_description],
             **kwargs
@@ -210,16 +274,26 @@ class BotoBasics:
         self._s3_resource = self._get_or_create_resource(self._s3_resource, "s3")
         return self._s3_resource
 
+    # Unlike resources, clients are thread safe. This one can be shared by up to `max_pool_connections` threads
+    # without them having to wait for a connection.
+    def create_s3_client(self, max_pool_connections) -> S3Client:
+        config = self._config.merge(Config(max_pool_connections=max_pool_connections))
+        return self._session.client("s3", config=config)
+
     def _get_s3_client(self) -> S3Client:
         return self._get_s3_resource().meta.client
 
     def create_bucket(self, name):
         return self._get_s3_resource().create_bucket(Bucket=name, CreateBucketConfiguration=self._bucket_config)
 
+    @staticmethod
+    def empty_bucket(bucket):
+        bucket.objects.all().delete()
+
     @staticmethod
     def delete_bucket(bucket):
         # You have to delete a bucket's contents before you can delete it.
-        bucket.objects.all().delete()
+        BotoBasics.empty_bucket(bucket)
         bucket.delete()
 
     def get_bucket(self, name):
@@ -231,15 +305,21 @@ class BotoBasics:
         return self._get_s3_resource().buckets.all()
 
     # Uses a paginator, so it can handle even frame counts greater than 1000.
-    def list_objects(self, bucket_name, subdirectory=None) -> List[str]:
+    def _list_contents(self, bucket_name, subdirectory):
         kwargs = {}
         if subdirectory is not None:
             kwargs["Prefix"] = subdirectory + "/"
         paginator = self._get_s3_client().get_paginator("list_objects_v2")
         iterator = paginator.paginate(Bucket=bucket_name, **kwargs)
         # If there are no objects the iterator returns a single item that contains no "Contents" key.
-        contents = _flatten([i["Contents"] for i in iterator if "Contents" in i])
-        return [obj["Key"] for obj in contents]
+        return _flatten([i["Contents"] for i in iterator if "Contents" in i])
+
+    def list_objects(self, bucket_name, subdirectory=None) -> List[str]:
+        return [obj["Key"] for obj in self._list_contents(bucket_name, subdirectory)]
+
+    # Returns a map of keys to object sizes.
+    def list_object_sizes(self, bucket_name, subdirectory=None) -> Dict[str, int]:
+        return {obj["Key"]: obj["Size"] for obj in self._list_contents(bucket_name, subdirectory)}
 
     @staticmethod
     def object_exists(obj: Object) -> bool:
@@ -262,13 +342,18 @@ class BotoBasics:
         return self._get_dynamodb_resource().meta.client.exceptions
 
     # Creating a table can take 20s.
-    def create_table(self, name, schema, defs):
+    def create_table(self, name, schema, defs, indexes=None):
         print(f"Creating table {name}...")
+        kwargs = {}
+        # With "PAY_PER_REQUEST" billing, indexes don't need any provisioned throughput.
+        if indexes is not None:
+            kwargs["GlobalSecondaryIndexes"] = indexes
         table = self._get_dynamodb_resource().create_table(
             TableName=name,
             KeySchema=schema,
             AttributeDefinitions=defs,
-            BillingMode="PAY_PER_REQUEST"
+            BillingMode="PAY_PER_REQUEST",
+            **kwargs
         )
         _show_time("Table creation", lambda: table.wait_until_exists())
         return table
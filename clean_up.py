@@ -1,26 +1,70 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
 from boto_basics import BotoBasics
 from names import Names
+from resource_pool import ResourcePool, POOL_TABLE
 
 basics = BotoBasics()
 
 
+def _delete_log_group(name):
+    BotoBasics().delete_log_group(name)
+    print(f"Deleted log group {name}")
+
+
+def _delete_bucket(name):
+    thread_basics = BotoBasics()
+    thread_basics.delete_bucket(thread_basics.get_bucket(name))
+    print(f"Deleted bucket {name}")
+
+
+def _delete_table(name):
+    thread_basics = BotoBasics()
+    thread_basics.delete_table(thread_basics.get_table(name))
+    print(f"Deleted table {name}")
+
+
+# Returns the names of the resources of the sets that are available in the resource pool - these are kept unless
+# `include_pool` is true. Other sets are left over from jobs that didn't finish and are deleted like any other
+# orphaned resources.
+def _get_pooled(include_pool):
+    if include_pool or POOL_TABLE not in [table.table_name for table in basics.list_tables()]:
+        return set()
+    pooled = set()
+    for set_id in ResourcePool.prune(basics):
+        names = Names(set_id)
+        pooled.update([names.log_group, names.bucket, names.dynamodb])
+    return pooled
+
+
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--include-pool", action="store_true", help="also delete the resource pool")
+    args = parser.parse_args()
+
     names = Names("")
+    pooled = _get_pooled(args.include_pool)
+
+    # Deleting a table can take 20s, so everything is deleted concurrently.
+    with ThreadPoolExecutor() as executor:
+        futures = []
+        for log_group in basics.list_log_groups(prefix=names.log_group):
+            name = log_group["logGroupName"]
+            if name not in pooled:
+                futures.append(executor.submit(_delete_log_group, name))
 
-    for log_group in basics.list_log_groups(prefix=names.log_group):
-        name = log_group["logGroupName"]
-        basics.delete_log_group(name)
-        print(f"Deleted log group {name}")
+        for bucket in basics.list_buckets():
+            if bucket.name.startswith(names.bucket) and bucket.name not in pooled:
+                futures.append(executor.submit(_delete_bucket, bucket.name))
 
-    for bucket in basics.list_buckets():
-        if bucket.name.startswith(names.bucket):
-            basics.delete_bucket(bucket)
-            print(f"Deleted bucket {bucket.name}")
+        for table in basics.list_tables():
+            name = table.table_name
+            if (name.startswith(names.dynamodb) and name not in pooled) or (args.include_pool and name == POOL_TABLE):
+                futures.append(executor.submit(_delete_table, name))
 
-    for table in basics.list_tables():
-        if table.table_name.startswith(names.dynamodb):
-            basics.delete_table(table)
-            print(f"Deleted table {table.table_name}")
+        for future in futures:
+            future.result()
 
 
 if __name__ == "__main__":
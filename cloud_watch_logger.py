@@ -1,5 +1,6 @@
 from boto_basics import BotoBasics
 from mypy_boto3_logs.type_defs import InputLogEventTypeDef
+from threading import Lock
 from time import time
 
 
@@ -11,16 +12,21 @@ class CloudWatchLogger:
         self._group_name = group_name
         self._stream_name = stream_name
         self._sequence = None
+        # The sequence token means that only one thread at a time can log.
+        self._lock = Lock()
 
     # To tail these entries, use 'aws logs tail <group-name> --follow'.
     def info(self, message):
         millis = int(time() * 1000)
         event = InputLogEventTypeDef(timestamp=millis, message=message)
         retries = 0
-        while retries <= self._MAX_RETRIES:
-            try:
-                self._sequence = self._basics.put_log_event(self._group_name, self._stream_name, event, self._sequence)
-                return
-            except self._basics.logs_exceptions.InvalidSequenceTokenException as e:
-                self._sequence = e.response["expectedSequenceToken"]
-                retries += 1
+        with self._lock:
+            while retries <= self._MAX_RETRIES:
+                try:
+                    self._sequence = self._basics.put_log_event(
+                        self._group_name, self._stream_name, event, self._sequence
+                    )
+                    return
+                except self._basics.logs_exceptions.InvalidSequenceTokenException as e:
+                    self._sequence = e.response["expectedSequenceToken"]
+                    retries += 1
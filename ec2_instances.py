@@ -1,19 +1,34 @@
-from collections import Counter
-from time import sleep
+import re
+from collections import Counter, defaultdict
+from queue import Queue
+from typing import Optional
 
+from botocore.exceptions import ClientError
 from botocore.utils import parse_timestamp
 
 from datetime import datetime, timezone
 from pathlib import Path
 
-from boto_basics import BotoBasics
+from adaptive_poller import AdaptivePoller
+from boto_basics import BotoBasics, format_api_calls
+from fleet_controller import FleetController
+from instance_costs import InstanceUsageTracker
 from log_retriever import LogsRetriever
+from render_progress import ProgressMonitor
+from straggler_speculator import StragglerSpeculator
+from timings import TimingsAggregator
 
-# It takes about 30s for a typical instance to start (go from "pending" to "running" and a similar amount of
-# time to go from "running" via "shutting-down" to "terminated"). So 10s seems a reasonable polling interval.
 from utils import timedelta_fmt
 
-_POLLING_INTERVAL = 10
+# The shortest and longest intervals, in seconds, at which each source is polled while monitoring a job. It takes
+# about 30s for a typical instance to start (go from "pending" to "running" and a similar amount of time to go from
+# "running" via "shutting-down" to "terminated"). So 10s seems a reasonable interval while states are changing.
+_LOGS_POLLING_INTERVALS = (5, 30)
+_INSTANCES_POLLING_INTERVALS = (10, 120)
+_PROGRESS_POLLING_INTERVALS = (5, 60)
+
+# Matches the instance IDs in e.g. an `InvalidInstanceID.NotFound` error message.
+_INSTANCE_ID = re.compile(r"i-[0-9a-f]+")
 
 
 def _now():
@@ -33,13 +48,25 @@ def _get_latest_image_id(basics, image_name_pattern, image_owner):
     return image["ImageId"]
 
 
+# The errors that mean there's currently no capacity, or no capacity at an acceptable price, for a given placement.
+_CAPACITY_ERRORS = [
+    "InsufficientInstanceCapacity",
+    "SpotMaxPriceTooLow",
+    "MaxSpotInstanceCountExceeded",
+    "Unsupported"
+]
+
+
+# Instances are launched in the first of the ranked `placements` (see `instance_selection.rank_placements`) that has
+# capacity, then in the next one for however many instances are still missing and so on. Returns a map of the IDs of
+# the launched instances to their placements.
 def create_instances(
     basics: BotoBasics,
     instance_count,
     instance_name,
     image_name_pattern,
     image_owner,
-    instance_type,
+    placements,
     security_group_name,
     key_name,
     iam_instance_profile,
@@ -49,117 +76,224 @@ def create_instances(
 
     user_data = Path(user_data_filename).read_text()
 
-    instances = basics.create_instances(
-        name=instance_name,
-        image_id=image_id,
-        instance_type=instance_type,
-        security_group_name=security_group_name,
-        key_name=key_name,
-        iam_instance_profile=iam_instance_profile,
-        user_data=user_data,
-        count=instance_count,
-        spot=True
-    )
-
-    # `created_count` should always equal `instance_count` unless price constraints are added.
-    created_count = len(instances)
-
-    availability_zone = {instance.placement["AvailabilityZone"] for instance in instances}
-
-    assert len(availability_zone) == 1, f"expected one availability zone, found {availability_zone}"
-
-    availability_zone = next(iter(availability_zone))
-
-    print(f"Availability zone: {availability_zone}")
-
-    instance_ids = [instance.instance_id for instance in instances]
-    basics.wait_instances_exist(instance_ids)
-
-    print(f"Started {created_count} {instance_type} instances")
-    _report_per_hour_price(basics, instance_type, created_count, availability_zone)
-
-    return instance_ids, availability_zone
-
-
-def _report_per_hour_price(basics: BotoBasics, instance_type, instance_count, availability_zone):
-    spot_price_history = basics.describe_spot_price_history(instance_type, availability_zone, _now())
-    prices = [float(item["SpotPrice"]) for item in spot_price_history]
-    max_price = max(prices)
-    total_price = max_price * instance_count
-
-    print(f"The current spot price is US${max_price:.2f} per hour")
-    print(f"That's US${total_price:.2f} for {instance_count} instances per hour")
-
-
-def _report_price_guesstimate(
+    launched = {}
+    for placement in placements:
+        count = instance_count - len(launched)
+        if count == 0:
+            break
+        try:
+            instances = basics.create_instances(
+                name=instance_name,
+                image_id=image_id,
+                instance_type=placement.instance_type,
+                security_group_name=security_group_name,
+                key_name=key_name,
+                iam_instance_profile=iam_instance_profile,
+                user_data=user_data,
+                count=count,
+                min_count=1,
+                spot=True,
+                availability_zone=placement.availability_zone
+            )
+        except ClientError as e:
+            code = e.response["Error"]["Code"]
+            if code not in _CAPACITY_ERRORS:
+                raise e
+            print(f"No {placement.instance_type} capacity in {placement.availability_zone} ({code})")
+            continue
+        print(f"Started {len(instances)} {placement.instance_type} instances in {placement.availability_zone}")
+        for instance in instances:
+            launched[instance.instance_id] = placement
+
+    if len(launched) == 0:
+        raise RuntimeError(f"no capacity for any of {placements}")
+
+    basics.wait_instances_exist(list(launched))
+
+    _report_per_hour_price(basics, launched)
+
+    return launched
+
+
+def _group_by_placement(instances):
+    groups = defaultdict(list)
+    for instance_id, placement in instances.items():
+        groups[placement].append(instance_id)
+    return groups
+
+
+def _report_per_hour_price(basics: BotoBasics, instances):
+    total_price = 0
+    for placement, instance_ids in _group_by_placement(instances).items():
+        spot_price_history = basics.describe_spot_price_history(
+            placement.instance_type, placement.availability_zone, _now()
+        )
+        max_price = max(float(item["SpotPrice"]) for item in spot_price_history)
+        total_price += max_price * len(instance_ids)
+        print(f"The current {placement.instance_type} spot price in {placement.availability_zone} is US${max_price:.2f} per hour")
+
+    print(f"That's US${total_price:.2f} for {len(instances)} instances per hour")
+
+
+# Monitor the instances, track their progress and terminate them once completed. The phase timings logged by the
+# workers are collected, rather than printed, and summarized at the end. Similarly, the progress of the frames being
+# rendered, each with `samples` samples, is used to estimate when the job will finish. `on_completed` is called
+# whenever more frames have been completed, e.g. so they can be downloaded straight away. If there's a `fleet`
+# controller, it's given the chance to launch or terminate instances while there are still frames to render.
+# `instances` maps instance IDs to their placements. Returns the frames per instance-hour achieved by each type.
+#
+# The log events, the instance states and the job's progress are each polled on their own thread, at an interval that
+# adapts to how often they change, and handled, as they arrive, here. All the polling is done at the shortest
+# intervals while instances are booting and once the job reaches its tail. boto3 resources, and the lazy creation of
+# clients, aren't thread safe, so the logs and instances pollers each get their own `BotoBasics` and `get_progress`
+# must not use anything, e.g. a `FramesTable`, that's also used on the calling thread. The pollers' `BotoBasics` count
+# their API calls along with those of `basics`.
+def monitor_and_terminate(
     basics: BotoBasics,
-    instance_type,
-    instance_count,
-    availability_zone,
-    start_time,
-    end_time
+    group_name,
+    instances,
+    get_progress,
+    samples,
+    on_completed,
+    fleet: Optional[FleetController] = None,
+    speculator: Optional[StragglerSpeculator] = None
 ):
-    running_time = end_time - start_time
-    total_time = running_time * instance_count
-    total_secs = total_time.total_seconds()
-    total_mins = total_time.total_seconds() / 60
-
-    spot_price_history = basics.describe_spot_price_history(instance_type, availability_zone, start_time, end_time)
-    spot_price_history = [(item["Timestamp"], float(item["SpotPrice"])) for item in spot_price_history]
-    prices = {item[1] for item in spot_price_history}
-
-    # This probably almost never happens - if it does then the price calculation needs to be made smarter.
-    if len(prices) > 1:
-        print(f"Prices changed over the time period - the price history is {spot_price_history}")
-
-    # For the moment, always use the worst price, rather than trying something more complex.
-    max_price = max(prices)
-
-    price = max_price * total_secs / 3600
-
-    print(f"{instance_count} instances ran for {timedelta_fmt(running_time)} of wall-clock time")
-    print(f"The spot price during this period was at most US${max_price:.2f} per hour")
-    print(f"At that price, the total of {total_mins:.3f} minutes of EC2 instance time would cost US${price:.2f}")
-
-
-# Monitor the instances, track their progress and terminate them once completed.
-def monitor_and_terminate(basics: BotoBasics, group_name, instance_type, instance_ids, availability_zone, is_finished):
     start_time = _now()
+    calls_before = basics.get_all_api_calls()
 
-    retriever = LogsRetriever()
+    # Replacement instances are added as they're launched.
+    instances = dict(instances)
+    usage = InstanceUsageTracker()
 
-    check_is_finished = True
-    prev_states = {}
+    retriever = LogsRetriever()
+    timings = TimingsAggregator()
+    render_progress = ProgressMonitor(samples)
 
-    while True:
-        # Poll for log events from the workers and print them before anything else otherwise, the timestamps
-        # of these already occurred remote events will mix oddly with local timestamps generated below.
-        log_events = retriever.get_log_events(basics, group_name)
+    def handle_log_events(log_events):
         for event in log_events:
+            usage.add_log_event(event)
+            if timings.add(event["message"]):
+                continue
+            if render_progress.add(event):
+                continue
             local_datetime = retriever.to_local_datetime_str(event["timestamp"])
             print(f"{local_datetime} {event['logStreamName']} {event['message']}")
-
-        # Check if all instances have terminated - if so exit the loop.
-        descriptions = basics.describe_instances(instance_ids)
-        states = {description["InstanceId"]: description["State"]["Name"] for description in descriptions}
-        if states != prev_states:
-            prev_states = states
-            states_counter = Counter(states.values())
-            print(f"{datetime.now()} Instances: {dict(states_counter)}")
-
-            terminated = states_counter["terminated"]
-            if terminated == len(instance_ids):
-                print("All instances have been terminated")
-                break
-
-        # Check if the job is finished - if so initiate the termination of still running instances.
-        if check_is_finished and is_finished():
-            check_is_finished = False
-            # Aggressively terminate any instances that are not yet aware that ongoing work is redundant.
-            running = [instance_id for instance_id, state in states.items() if state == "running"]
-            print(f"Terminating {len(running)} instances that are still running")
-            basics.terminate_instances(running)
-
-        sleep(_POLLING_INTERVAL)
-
-    _report_price_guesstimate(basics, instance_type, len(instance_ids), availability_zone, start_time, _now())
+        retriever.record_displayed(log_events)
+
+    # Instances are only described until they're seen to have terminated.
+    watched = list(instances)
+    logs_basics = BotoBasics(basics.api_calls)
+    instances_basics = BotoBasics(basics.api_calls)
+    results = Queue()
+    pollers = {
+        "logs": AdaptivePoller(
+            "logs", lambda: retriever.get_log_events(logs_basics, group_name), results, *_LOGS_POLLING_INTERVALS
+        ),
+        "instances": AdaptivePoller(
+            "instances", lambda: _describe_instances(instances_basics, watched), results, *_INSTANCES_POLLING_INTERVALS
+        ),
+        "progress": AdaptivePoller("progress", get_progress, results, *_PROGRESS_POLLING_INTERVALS)
+    }
+
+    states = {}
+    progress = None
+    finished = False
+
+    for poller in pollers.values():
+        poller.start()
+    try:
+        while True:
+            name, result = results.get()
+            if isinstance(result, Exception):
+                raise result
+
+            if name == "logs":
+                handle_log_events(result)
+                if progress is not None:
+                    render_progress.print_estimate(progress.remaining)
+
+            elif name == "instances":
+                usage.add_descriptions(result, _now())
+                latest = {**states, **{d["InstanceId"]: d["State"]["Name"] for d in result}}
+                if latest != states:
+                    states = latest
+                    states_counter = Counter(states.values())
+                    print(f"{datetime.now()} Instances: {dict(states_counter)}")
+                    # Check if all instances have terminated - if so exit the loop.
+                    if states_counter["terminated"] == len(instances):
+                        print("All instances have been terminated")
+                        break
+                    watched = [instance_id for instance_id in instances if states.get(instance_id) != "terminated"]
+
+            elif name == "progress" and not finished:
+                if progress is None or result.completed != progress.completed:
+                    on_completed()
+                if result != progress:
+                    available = result.remaining - result.claimed
+                    print(
+                        f"{datetime.now()} Frames: {result.completed} completed, "
+                        f"{result.claimed} claimed and {available} available"
+                    )
+                progress = result
+                # Check if the job is finished - if so initiate the termination of still running instances.
+                if progress.remaining == 0:
+                    finished = True
+                    # Aggressively terminate any instances that are not yet aware that ongoing work is redundant.
+                    running = [instance_id for instance_id, state in states.items() if state == "running"]
+                    print(f"Terminating {len(running)} instances that are still running")
+                    basics.terminate_instances(running)
+                    pollers["progress"].stop()
+                    pollers["instances"].wake()
+                else:
+                    if speculator is not None:
+                        speculator.update(progress, timings)
+                    # The fleet controller needs to know the state of every instance.
+                    if fleet is not None and all(instance_id in states for instance_id in instances):
+                        launched = fleet.update(states, progress)
+                        instances.update(launched)
+                        watched = watched + list(launched)
+
+            booting = progress is None or progress.completed == 0 or "pending" in states.values()
+            tail = progress is not None and progress.remaining == progress.claimed
+            for poller in pollers.values():
+                poller.set_urgent(booting or tail or finished)
+    finally:
+        for poller in pollers.values():
+            poller.stop()
+
+    # Pick up whatever the workers logged just before they exited.
+    handle_log_events(retriever.get_log_events(logs_basics, group_name))
+
+    frames_per_hour = usage.report(basics, instances, _now())
+    timings.report()
+    retriever.report_lag()
+    _report_api_calls(basics, calls_before, _now() - start_time)
+    return frames_per_hour
+
+
+# Newly launched instances may not be visible yet. The error only names the missing instances, e.g. "The instance IDs
+# 'i-1, i-2' do not exist", so the others are described again without them and the missing ones are left out until
+# the next poll.
+def _describe_instances(basics: BotoBasics, instance_ids):
+    while len(instance_ids) != 0:  # An empty list of IDs would describe every instance.
+        try:
+            return basics.describe_instances(instance_ids)
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "InvalidInstanceID.NotFound":
+                raise
+            missing = set(_INSTANCE_ID.findall(e.response["Error"].get("Message", "")))
+            if len(missing & set(instance_ids)) == 0:
+                return []  # Which instances are missing can't be told, so try them all again next time.
+            instance_ids = [instance_id for instance_id in instance_ids if instance_id not in missing]
+    return []
+
+
+def _report_api_calls(basics: BotoBasics, calls_before, duration):
+    calls = basics.get_all_api_calls()
+    calls.subtract(calls_before)
+    total = sum(calls.values())
+    minutes = max(duration.total_seconds() / 60, 1)
+    print(
+        f"Monitoring made {total} AWS API calls in {timedelta_fmt(duration)} ({total / minutes:.1f} per minute): "
+        f"{format_api_calls(calls)}"
+    )
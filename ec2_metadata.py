@@ -1,6 +1,10 @@
 import json
+import os
 from os.path import isfile
 from pathlib import Path
+from time import time
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
 
 import botocore.session
 
@@ -9,6 +13,17 @@ _INSTANCE_DATA = "/run/cloud-init/instance-data.json"
 
 _CANNED_INSTANCE_DATA = None
 
+# The instance metadata service is accessed using IMDSv2, i.e. with a session token. botocore honours the same
+# variable, for overriding the endpoint, e.g. to point to `fake_metadata_server.py` when running locally.
+# See https://docs.aws.amazon.com/AWSEC2/latest/UserGuide/configuring-instance-metadata-service.html
+_METADATA_ENDPOINT_VARIABLE = "AWS_EC2_METADATA_SERVICE_ENDPOINT"
+_DEFAULT_METADATA_ENDPOINT = "http://169.254.169.254"
+_TOKEN_TTL = 21600
+_METADATA_TIMEOUT = 2
+
+_token = None
+_token_expiry = 0
+
 
 def _create_canned_instance_data(region):
     return {
@@ -43,3 +58,49 @@ def get_instance_id():
 
 def get_region():
     return _get_ec2_v1_metadata()["region"]
+
+
+def is_metadata_service_available():
+    return is_aws() or _METADATA_ENDPOINT_VARIABLE in os.environ
+
+
+def _get_endpoint():
+    return os.environ.get(_METADATA_ENDPOINT_VARIABLE, _DEFAULT_METADATA_ENDPOINT).rstrip("/")
+
+
+def _get_token():
+    global _token, _token_expiry
+    # Renew the token a minute before it expires.
+    if _token is None or time() > _token_expiry:
+        request = Request(
+            f"{_get_endpoint()}/latest/api/token",
+            method="PUT",
+            headers={"X-aws-ec2-metadata-token-ttl-seconds": str(_TOKEN_TTL)}
+        )
+        with urlopen(request, timeout=_METADATA_TIMEOUT) as response:
+            _token = response.read().decode()
+        _token_expiry = time() + _TOKEN_TTL - 60
+    return _token
+
+
+# Returns `None` if there's no such item, e.g. most spot-related items only exist once AWS has given notice.
+def _get_metadata(path):
+    global _token
+    request = Request(f"{_get_endpoint()}/latest/meta-data/{path}", headers={"X-aws-ec2-metadata-token": _get_token()})
+    try:
+        with urlopen(request, timeout=_METADATA_TIMEOUT) as response:
+            return response.read().decode()
+    except HTTPError as e:
+        if e.code == 404:
+            return None
+        if e.code == 401:
+            # The token is no longer valid, so get a new one next time.
+            _token = None
+        raise
+
+
+# If AWS has given notice that this spot instance is about to be interrupted, returns the action and the time at
+# which it will happen, e.g. `{"action": "terminate", "time": "2017-09-18T08:22:00Z"}`, otherwise returns `None`.
+def get_spot_interruption():
+    content = _get_metadata("spot/instance-action")
+    return json.loads(content) if content is not None else None
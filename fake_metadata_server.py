@@ -0,0 +1,63 @@
+import argparse
+import json
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import time
+
+# A stand-in for the EC2 instance metadata service, for seeing how a worker, run locally, handles a spot
+# interruption notice. Start it and then run the worker with the endpoint pointing to it:
+#
+#   $ python fake_metadata_server.py --interrupt-after 60
+#   $ AWS_EC2_METADATA_SERVICE_ENDPOINT=http://localhost:1338 python run_worker.py ...
+#
+# Only the IMDSv2 token and the spot interruption notice are supported.
+
+_TOKEN = "fake-token"
+
+# AWS gives two minutes notice.
+_NOTICE_PERIOD = timedelta(minutes=2)
+
+
+def _create_handler(interrupt_time):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, code, content=""):
+            body = content.encode()
+            self.send_response(code)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_PUT(self):
+            if self.path == "/latest/api/token" and "X-aws-ec2-metadata-token-ttl-seconds" in self.headers:
+                self._reply(200, _TOKEN)
+            else:
+                self._reply(400)
+
+        def do_GET(self):
+            if self.headers.get("X-aws-ec2-metadata-token") != _TOKEN:
+                self._reply(401)
+            elif self.path == "/latest/meta-data/spot/instance-action" and time() >= interrupt_time:
+                action_time = datetime.fromtimestamp(interrupt_time, timezone.utc) + _NOTICE_PERIOD
+                self._reply(200, json.dumps({"action": "terminate", "time": action_time.strftime("%Y-%m-%dT%H:%M:%SZ")}))
+            else:
+                self._reply(404)
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=1338)
+    parser.add_argument(
+        "--interrupt-after", type=int, default=60, metavar="SECONDS",
+        help="number of seconds after which the spot interruption notice is given"
+    )
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("localhost", args.port), _create_handler(time() + args.interrupt_after))
+    print(f"Serving on port {args.port} - the interruption notice will be given in {args.interrupt_after}s")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
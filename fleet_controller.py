@@ -0,0 +1,111 @@
+import statistics
+from time import time
+
+from botocore.exceptions import ClientError
+
+from boto_basics import BotoBasics
+from frames_table import FramesTable, Progress
+
+_LIVE_STATES = ["pending", "running"]
+
+
+# Keeps the number of instances in line with the work that's left. Instances that are lost, e.g. spot instances that
+# AWS reclaims, are replaced but only if the job won't be finished before a replacement could boot. And once there
+# are more instances than frames left to claim, the instances that aren't doing anything are terminated rather than
+# being left to boot, find nothing to do and shut down. An instance is busy if it holds a lease on a frame - a worker's
+# lease owner is its instance ID followed by its render slot (see `run_worker.py`).
+class FleetController:
+    # The time from launch to an instance's first claim is used as its boot time. This is the assumed boot time until
+    # one has actually been observed.
+    _DEFAULT_BOOT_SECONDS = 240
+
+    # If launching fails, e.g. because there's currently no spot capacity, wait this long before trying again.
+    _LAUNCH_BACKOFF = 60
+
+    # `launch(count)` launches up to `count` instances and returns a map of their IDs to their placements. At most
+    # `max_launches` instances are launched in total, so that instances that fail during boot, e.g. due to a bad
+    # image, aren't endlessly replaced. Up to `spare_count` idle instances are kept, beyond those needed, e.g. so there
+    # are workers to pick up straggling frames when they're re-issued (see `straggler_speculator.py`).
+    def __init__(
+        self, basics: BotoBasics, frames_table: FramesTable, target_count, launch, max_launches, spare_count=0
+    ):
+        self._basics = basics
+        self._frames_table = frames_table
+        self._target_count = target_count
+        self._spare_count = spare_count
+        self._launch = launch
+        self._launches_left = max_launches
+        self._launch_times = {}
+        self._boot_times = {}
+        self._terminated = set()
+        self._next_launch_time = 0
+
+    def add_instances(self, instance_ids):
+        now = time()
+        for instance_id in instance_ids:
+            self._launch_times[instance_id] = now
+
+    def _get_boot_seconds(self):
+        if len(self._boot_times) == 0:
+            return self._DEFAULT_BOOT_SECONDS
+        return statistics.median(self._boot_times.values())
+
+    # Without any completed frames, there's no basis for an estimate, but the job clearly isn't nearly done.
+    @staticmethod
+    def _estimate_seconds_left(progress: Progress, live_count):
+        if progress.completed == 0:
+            return None
+        mean_seconds = progress.render_millis / 1000 / progress.completed
+        return progress.remaining * mean_seconds / max(live_count, 1)
+
+    def _terminate(self, instance_ids, reason):
+        self._basics.terminate_instances(instance_ids)
+        self._terminated.update(instance_ids)
+        print(f"Terminated {len(instance_ids)} instances {reason}")
+
+    def _launch_replacements(self, count):
+        if time() < self._next_launch_time:
+            return {}
+        try:
+            instances = self._launch(count)
+        except (ClientError, RuntimeError) as e:
+            print(f"Failed to launch {count} replacement instances: {e}")
+            self._next_launch_time = time() + self._LAUNCH_BACKOFF
+            return {}
+        self._launches_left -= len(instances)
+        self.add_instances(instances)
+        return instances
+
+    # `states` maps each instance ID to its current state. Returns a map of any instances that were launched to
+    # their placements.
+    def update(self, states, progress: Progress):
+        now = time()
+        busy = {lease["lease_owner"].split("/")[0] for lease in self._frames_table.get_leases()}
+        for instance_id in busy:
+            if instance_id in self._launch_times and instance_id not in self._boot_times:
+                self._boot_times[instance_id] = now - self._launch_times[instance_id]
+
+        live = [i for i, state in states.items() if state in _LIVE_STATES and i not in self._terminated]
+        available = progress.remaining - progress.claimed
+        # Each busy instance carries on with its frames and each other instance can take at most one of those left.
+        wanted = min(self._target_count, len(busy.intersection(live)) + available + self._spare_count)
+
+        surplus = len(live) - wanted
+        if surplus > 0:
+            # The most recently launched are the furthest from being able to do anything.
+            idle = sorted((i for i in live if i not in busy), key=lambda i: self._launch_times.get(i, 0), reverse=True)
+            if len(idle) != 0:
+                self._terminate(idle[:surplus], f"as there are only {available} frames left to claim")
+            return {}
+
+        shortfall = min(wanted - len(live), self._launches_left)
+        if shortfall <= 0:
+            return {}
+        seconds_left = self._estimate_seconds_left(progress, len(live))
+        boot_seconds = self._get_boot_seconds()
+        if seconds_left is not None and seconds_left < boot_seconds:
+            return {}  # The job should be done before a replacement could boot.
+        instances = self._launch_replacements(shortfall)
+        if len(instances) != 0:
+            print(f"Launched {len(instances)} replacement instances (boot time is about {boot_seconds:.0f}s)")
+        return instances
@@ -0,0 +1,117 @@
+import heapq
+from bisect import bisect_left
+from datetime import datetime, timedelta
+
+from blender import run_blender, dump_dict, recover_dict
+from utils import timedelta_fmt
+
+# The estimation renders are just meant to capture how the cost varies from frame to frame, so they use far fewer
+# samples and pixels than the real renders.
+_ESTIMATE_SAMPLES = 16
+_ESTIMATE_RESOLUTION_PERCENTAGE = 25
+
+
+# Render every `every`-th frame at low quality, in a single Blender session, and time each render. The first
+# frame is rendered twice, with the first render discarded, as it includes one-off costs like building kernels.
+def _time_sample_frames(blender, input_file, frames, motion_blur):
+    code = f"""
+        import time
+        import bpy
+
+        scene = bpy.context.scene
+        scene.cycles.samples = {_ESTIMATE_SAMPLES}
+        scene.render.resolution_percentage = {_ESTIMATE_RESOLUTION_PERCENTAGE}
+        scene.render.use_motion_blur = {motion_blur}
+
+        frames = {frames}
+        scene.frame_set(frames[0])
+        bpy.ops.render.render()
+
+        # JSON keys must be strings.
+        times = {{}}
+        for frame in frames:
+            scene.frame_set(frame)
+            start = time.perf_counter()
+            bpy.ops.render.render()
+            times[str(frame)] = time.perf_counter() - start
+
+        {dump_dict("times")}
+    """
+    times = recover_dict(run_blender(blender, input_file, code, capture_output=True))
+    return {int(frame): seconds for frame, seconds in times.items()}
+
+
+# Linearly interpolate the cost of each frame from the costs of the sampled frames on either side of it.
+def _interpolate(frames, sampled):
+    xs = sorted(sampled)
+    costs = {}
+    for frame in frames:
+        i = bisect_left(xs, frame)
+        if i == 0:
+            costs[frame] = sampled[xs[0]]
+        elif i == len(xs):
+            costs[frame] = sampled[xs[-1]]
+        else:
+            x0, x1 = xs[i - 1], xs[i]
+            costs[frame] = sampled[x0] + (sampled[x1] - sampled[x0]) * (frame - x0) / (x1 - x0)
+    return costs
+
+
+# Returns a map of frame numbers to predicted costs. The costs are only meaningful relative to each other.
+def estimate_frame_costs(blender, input_file, frames, every, motion_blur):
+    frames = sorted(frames)
+    sample_frames = frames[::every]
+    # Always include the last frame, so there's nothing to extrapolate.
+    if sample_frames[-1] != frames[-1]:
+        sample_frames.append(frames[-1])
+    print(f"Estimating frame costs by rendering {len(sample_frames)} of {len(frames)} frames at low quality...")
+    sampled = _time_sample_frames(blender, input_file, sample_frames, motion_blur)
+    return _interpolate(frames, sampled)
+
+
+# Simulate handing out frames, in the given order, to whichever worker becomes free first.
+def _simulate_makespan(ordered_costs, worker_count):
+    finish_times = [0.0] * worker_count
+    for cost in ordered_costs:
+        heapq.heapreplace(finish_times, finish_times[0] + cost)
+    return max(finish_times)
+
+
+# Wraps the `get_progress` function of a `FramesTable` in order to note when rendering started and ended.
+class MakespanTracker:
+    def __init__(self, get_progress):
+        self._get_progress = get_progress
+        self._start = None
+        self._end = None
+        self.progress = None
+
+    def get_progress(self):
+        self.progress = self._get_progress()
+        now = datetime.now()
+        if self._start is None and (self.progress.claimed != 0 or self.progress.completed != 0):
+            self._start = now
+        if self._end is None and self.progress.remaining == 0:
+            self._end = now
+        return self.progress
+
+    @property
+    def makespan(self) -> timedelta:
+        return self._end - self._start if self._start is not None and self._end is not None else None
+
+
+# Compare the makespan predicted for longest-processing-time-first ordering, and for plain frame ordering, with the
+# actual makespan. The predicted costs are scaled to match the actual total render time.
+def report_makespan(costs, worker_count, tracker: MakespanTracker):
+    progress = tracker.progress
+    if progress is None or tracker.makespan is None or progress.completed != len(costs):
+        print("Cannot compare predicted and actual makespan as the job did not complete")
+        return
+    scale = progress.render_millis / 1000 / sum(costs.values())
+    lpt = _simulate_makespan(sorted((c * scale for c in costs.values()), reverse=True), worker_count)
+    in_order = _simulate_makespan([costs[frame] * scale for frame in sorted(costs)], worker_count)
+
+    def fmt(seconds):
+        return timedelta_fmt(timedelta(seconds=seconds))
+
+    print(f"Predicted makespan, for {worker_count} workers, is {fmt(lpt)} (or {fmt(in_order)} in frame order)")
+    print(f"Actual makespan (from first claim to last completion) was {timedelta_fmt(tracker.makespan)}")
@@ -0,0 +1,92 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from threading import BoundedSemaphore, Lock
+
+from boto_basics import BotoBasics, get_s3_uri
+from frames_table import FramesTable
+from timings import PhaseTimings, format_timings
+from utils import hash_file
+
+# Rendered frames are moved here while they're uploaded, so Blender can render the next frame in the meantime. Each
+# render slot has its own subdirectory, as two slots can render the same frame (see `FramesTable.speculate`).
+_STAGING_DIR = "uploading"
+
+SHA256_METADATA = "sha256"
+
+
+# Uploads rendered frames, and marks them as completed, on background threads so that the GPU doesn't sit idle
+# waiting on S3 and DynamoDB. A frame is only marked as completed once its upload has succeeded. `slot_name` is the
+# name of the render slot whose frames are uploaded.
+class FrameUploader:
+    def __init__(self, basics: BotoBasics, logger, bucket, frames_table: FramesTable, slot_name, max_in_flight=2):
+        self._basics = basics
+        self._logger = logger
+        self._bucket = bucket
+        self._frames_table = frames_table
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        # Bounds the number of frames waiting to be uploaded - `submit` blocks once the limit is reached.
+        self._in_flight = BoundedSemaphore(max_in_flight)
+        self._futures = []
+        self._pending = set()
+        self._pending_lock = Lock()
+        self._staging_dir = os.path.join(_STAGING_DIR, slot_name)
+        Path(self._staging_dir).mkdir(parents=True, exist_ok=True)
+
+    def _upload(self, frame, staged_file, render_time, timings: PhaseTimings):
+        try:
+            basename = os.path.basename(staged_file)
+            # Resources aren't thread safe, so each upload gets its own `Object`. The underlying client is thread safe.
+            s3_output_file = self._bucket.Object(f"frames/{basename}")
+            with timings.phase("upload"):
+                if self._basics.object_exists(s3_output_file):
+                    # Skip upload if another worker already beat us to it.
+                    self._logger.info(f"completed frame {frame} but skipped upload")
+                else:
+                    # The hash lets the manager check the integrity of the frame when it downloads it.
+                    metadata = {SHA256_METADATA: hash_file(staged_file)}
+                    s3_output_file.upload_file(staged_file, ExtraArgs={"Metadata": metadata})
+                    self._logger.info(f"completed and uploaded {get_s3_uri(s3_output_file)}")
+            os.unlink(staged_file)
+            with timings.phase("complete"):
+                self._frames_table.complete_frame(frame, render_time)
+            self._logger.info(format_timings(frame, timings.timings))
+        finally:
+            with self._pending_lock:
+                self._pending.discard(frame)
+            self._in_flight.release()
+
+    # Raise the exception of any upload that has failed.
+    def _check_futures(self):
+        done = [future for future in self._futures if future.done()]
+        self._futures = [future for future in self._futures if not future.done()]
+        for future in done:
+            future.result()
+
+    # The frame is uploaded as `filename`, e.g. to distinguish the tiles of a frame. Once the frame is completed,
+    # `timings`, along with the time taken by the upload etc., is logged.
+    def submit(self, frame, output_file, render_time, filename, timings: PhaseTimings):
+        self._check_futures()
+        staged_file = os.path.join(self._staging_dir, filename)
+        os.rename(output_file, staged_file)
+        self._in_flight.acquire()
+        with self._pending_lock:
+            self._pending.add(frame)
+        self._futures.append(self._executor.submit(self._upload, frame, staged_file, render_time, timings))
+
+    # Returns the frames that have been submitted but not yet completed.
+    @property
+    def pending(self):
+        with self._pending_lock:
+            return set(self._pending)
+
+    # Waits for all outstanding uploads to complete.
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self._check_futures()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -1,65 +1,604 @@
+import random
+import zlib
+from collections import deque, namedtuple, defaultdict
+from threading import Event, Lock, Thread
+from time import sleep, time
+
 from boto_basics import BotoBasics
 from boto_basics import create_key_schema_element as table_key
 from boto_basics import create_attribute_definition as table_attr
+from boto_basics import create_global_secondary_index as table_index
+
+from boto3.dynamodb.conditions import Key
 
-from boto3.dynamodb.conditions import Attr
+# `remaining` counts every frame not yet completed, including those that are currently `claimed`.
+# `render_millis` is the total time spent rendering the completed frames.
+Progress = namedtuple("Progress", ["remaining", "claimed", "completed", "render_millis"])
 
 
 class FramesTable:
-    _MAX_IN_PROGRESS = 4
+    # Frames are spread round-robin over shards, i.e. partition keys, so that claims, renewals and completions
+    # don't all hit a single hot partition.
+    MAX_SHARDS = 100  # A shard's progress record is read via `BatchGetItem` which is limited to 100 keys.
+
+    # Only frames that have never been claimed carry the `available` attribute, so only they appear in this sparse
+    # index. Claiming a frame removes the attribute and with it the frame's entry in the index. So, a query of the
+    # index reads just a handful of items no matter how many frames the job has, unlike a scan of the whole table.
+    # The attribute's value is the frame's shard, so the index is sharded in the same way as the table. The index
+    # is sorted by `rank`, i.e. the order in which frames should be handed out.
+    _AVAILABLE_INDEX = "available-index"
+
+    # Similarly, only claimed frames carry the `leased` attribute. This index is sorted by lease expiry, so expired
+    # leases, e.g. those of spot instances that have been reclaimed by AWS, can be found without a scan.
+    _LEASED_INDEX = "leased-index"
+
+    # Fetch a few candidates rather than just one so that workers, that query at the same time, spread out rather
+    # than all racing for the first frame.
+    _QUERY_LIMIT = 8
+
+    # A lease is renewed by `LeaseKeeper` well before it expires, so only a lost worker's leases ever expire.
+    LEASE_DURATION = 60
+
+    # Each shard has its own progress record that lives alongside its frames. It's given a frame number well outside
+    # the range that Blender supports and, as it has neither an `available` nor a `leased` attribute, it never
+    # appears in either index.
+    _PROGRESS_FRAME = -2 ** 31
+
+    # The number of times a transaction is retried if it conflicts with another worker's concurrent transaction.
+    _MAX_CONFLICTS = 8
 
-    def __init__(self, basics: BotoBasics, name):
+    # A transaction can contain at most 100 items but claiming that many frames at once would starve other workers.
+    MAX_BATCH_SIZE = 25
+
+    # When adapting the batch size, aim for each batch to take about this many seconds to render. Any longer and
+    # frames sit in one worker's queue while other workers, near the end of the job, have nothing to do.
+    _TARGET_BATCH_SECONDS = 60
+
+    # Smoothing factor for the moving average of render times used when adapting the batch size.
+    _ALPHA = 0.3
+
+    # How long, and how often, workers wait for the manager to finish creating the table.
+    _READY_TIMEOUT = 600
+    _READY_POLLING_INTERVAL = 5
+
+    # If `adaptive` is true, `batch_size` is just the initial size - it's then adjusted based on render times.
+    def __init__(self, basics: BotoBasics, name, owner=None, batch_size=1, adaptive=False, shards=1):
         self._basics = basics
         self._table = basics.get_table(name)
-        self._in_progress = 0
+        self._owner = owner
+        self._shards = shards
+        # Each worker starts on a shard determined by its owner ID and only moves on once that shard runs dry.
+        self._home_shard = zlib.crc32(owner.encode()) % shards if owner is not None else 0
+        self._batch_size = max(1, min(batch_size, self.MAX_BATCH_SIZE))
+        self._adaptive = adaptive
+        self._mean_render_time = None
+        self._claimed = 0
+        self._queue = deque()
+        self._held = {}  # Maps each held frame to its shard.
+        self._held_lock = Lock()
 
-    def create(self, r):
+    def create(self, r, costs=None):
+        self.create_table()
+        self.populate(r, costs)
+
+    # Creates the table without any frames, e.g. in advance of a job (see `resource_pool.py`).
+    def create_table(self):
         # The unsorted "HASH" part of the key is mandatory, but we really only want the optional sorted "RANGE" part.
         self._table = self._basics.create_table(
             self._table.table_name,
-            [table_key("filler", "HASH"), table_key("frame", "RANGE")],
-            [table_attr("filler", "N"), table_attr("frame", "N")]
+            [table_key("shard", "HASH"), table_key("frame", "RANGE")],
+            [
+                table_attr("shard", "N"),
+                table_attr("frame", "N"),
+                table_attr("available", "N"),
+                table_attr("rank", "N"),
+                table_attr("leased", "N"),
+                table_attr("lease_expiry", "N")
+            ],
+            [
+                table_index(self._AVAILABLE_INDEX, [table_key("available", "HASH"), table_key("rank", "RANGE")]),
+                table_index(self._LEASED_INDEX, [table_key("leased", "HASH"), table_key("lease_expiry", "RANGE")])
+            ]
         )
+
+    # If `costs`, a map of frame numbers to predicted render times, is provided then frames are handed out
+    # longest-processing-time-first, i.e. in order of decreasing cost. Otherwise, they're handed out in order.
+    # In tile mode, the "frames" are really tiles, with numbers that encode both the frame and tile (see `tiles.py`).
+    def populate(self, r, costs=None):
+        frames = list(r)
+        if costs is not None:
+            # Python's sort is stable, so frames of equal cost stay in order.
+            frames.sort(key=lambda f: costs[f], reverse=True)
+        counts = [0] * self._shards
         with self._table.batch_writer() as batch:
-            for frame in r:
+            # Spreading frames round-robin, in rank order, gives each shard the same mix of heavy and light frames.
+            for rank, frame in enumerate(frames):
+                shard = rank % self._shards
                 batch.put_item({
-                    "filler": 0,
+                    "shard": shard,
                     "frame": frame,
-                    "in_progress": 0
+                    "rank": rank,
+                    "claims": 0,
+                    "available": shard
+                })
+                counts[shard] += 1
+            for shard, count in enumerate(counts):
+                batch.put_item({
+                    **self._progress_key(shard),
+                    "remaining": count,
+                    "claimed": 0,
+                    "completed": 0,
+                    "render_millis": 0
                 })
 
     def delete(self):
         self._basics.delete_table(self._table)
 
+    # Deletes every item, so the table can be populated again for another job, which is far quicker than deleting
+    # the table and creating a new one.
+    def clear(self):
+        kwargs = {"ProjectionExpression": "#s, #f", "ExpressionAttributeNames": {"#s": "shard", "#f": "frame"}}
+        with self._table.batch_writer() as batch:
+            while True:
+                response = self._table.scan(**kwargs)
+                for key in response["Items"]:
+                    batch.delete_item(Key=key)
+                if "LastEvaluatedKey" not in response:
+                    break
+                kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    def _progress_key(self, shard):
+        return {"shard": shard, "frame": self._PROGRESS_FRAME}
+
+    # A single `BatchGetItem` rather than a scan, so the cost doesn't depend on the size of the job.
+    def _get_progress_items(self):
+        client = self._table.meta.client
+        name = self._table.table_name
+        request = {name: {"Keys": [self._progress_key(shard) for shard in range(self._shards)], "ConsistentRead": True}}
+        items = []
+        while len(request) != 0:
+            response = client.batch_get_item(RequestItems=request)
+            items += response["Responses"].get(name, [])
+            request = response["UnprocessedKeys"]
+        return items
+
+    def get_progress(self) -> Progress:
+        items = self._get_progress_items()
+        return Progress(*(sum(int(item[field]) for item in items) for field in Progress._fields))
+
+    # Workers may be started while the manager is still creating the table. Until the table is fully populated, a
+    # worker could mistake it for a table where every frame has been completed. The progress records are written
+    # after all the frames, so the table is ready once they all exist.
+    def wait_until_ready(self):
+        client = self._table.meta.client
+        deadline = time() + self._READY_TIMEOUT
+        while True:
+            try:
+                if len(self._get_progress_items()) == self._shards:
+                    return
+            except client.exceptions.ResourceNotFoundException:
+                pass  # The table doesn't exist yet or is still being created.
+            if time() > deadline:
+                raise RuntimeError(f"table {self._table.table_name} did not become ready")
+            sleep(self._READY_POLLING_INTERVAL)
+
     def get_remaining(self):
-        return self._table.scan(Select="COUNT", ConsistentRead=True)["Count"]
+        return self.get_progress().remaining
+
+    def _progress_update(self, shard, update_expression, values):
+        return {
+            "Update": {
+                "TableName": self._table.table_name,
+                "Key": self._progress_key(shard),
+                "UpdateExpression": update_expression,
+                "ExpressionAttributeValues": values
+            }
+        }
+
+    # Applies the given action to all the given frames, along with the corresponding update to the progress record,
+    # in a single transaction. Transactions are all-or-nothing so, if the condition for some frames fails, e.g.
+    # because another worker got to them first, the transaction is retried without them. The frames must all be
+    # in the same shard and the progress update must be for that shard.
+    # Returns the frames for which the action succeeded.
+    def _transact_frames(self, nums, frame_action, progress_update):
+        # The resource's client, unlike a plain client, accepts normal Python values rather than typed ones.
+        client = self._table.meta.client
+        conflicts = 0
+        while len(nums) != 0:
+            try:
+                client.transact_write_items(
+                    TransactItems=[frame_action(num) for num in nums] + [progress_update(len(nums))]
+                )
+                return nums
+            except client.exceptions.TransactionCanceledException as e:
+                reasons = [reason["Code"] for reason in e.response.get("CancellationReasons", [])]
+                lost = {num for num, reason in zip(nums, reasons) if reason == "ConditionalCheckFailed"}
+                if len(lost) == 0:
+                    # Every worker updates the progress record, so transactions occasionally conflict with each other.
+                    if "TransactionConflict" not in reasons or conflicts == self._MAX_CONFLICTS:
+                        raise e
+                    conflicts += 1
+                    sleep(random.uniform(0, 0.1 * 2 ** conflicts))
+                nums = [num for num in nums if num not in lost]
+        return nums
 
-    def delete_frame(self, num):
-        self._table.delete_item(Key={"filler": 0, "frame": num})
+    def _get_shard(self, num):
+        with self._held_lock:
+            return self._held[num]
 
-    def _acquire(self, num, current):
+    def _complete(self, shard, num, condition, update_expression, values):
+        return self._transact_frames(
+            [num],
+            lambda n: {
+                "Delete": {
+                    "TableName": self._table.table_name,
+                    "Key": {"shard": shard, "frame": n},
+                    "ConditionExpression": condition
+                }
+            },
+            lambda count: self._progress_update(shard, update_expression, values)
+        )
+
+    def complete_frame(self, num, render_seconds):
+        with self._held_lock:
+            shard = self._held.get(num)
+        if shard is None:
+            return  # Another worker completed the frame first (see `drop_completed`).
+        values = {":minus": -1, ":one": 1, ":millis": int(render_seconds * 1000)}
+        # The conditions ensure that the progress record is only updated once, even if a frame is rendered twice.
+        if not self._complete(
+            shard,
+            num,
+            "attribute_exists(frame) AND attribute_not_exists(available)",
+            "ADD remaining :minus, claimed :minus, completed :one, render_millis :millis",
+            values
+        ):
+            # A frame that has been re-issued (see `speculate`), but not yet claimed again, doesn't count as claimed.
+            self._complete(
+                shard,
+                num,
+                "attribute_exists(available)",
+                "ADD remaining :minus, completed :one, render_millis :millis",
+                values
+            )
+        with self._held_lock:
+            self._held.pop(num, None)
+
+    # Records when rendering of the frame started, so the manager can spot stragglers (see `speculate`).
+    def start_frame(self, num):
+        with self._held_lock:
+            shard = self._held.get(num)
+        if shard is None:
+            return
+        self._update_lease(
+            shard,
+            num,
+            "SET started = :now",
+            "lease_owner = :owner",
+            {":now": int(time()), ":owner": self._owner}
+        )
+
+    def _lease_expiry(self):
+        return int(time()) + self.LEASE_DURATION
+
+    def _update_lease(self, shard, num, update_expression, condition, values):
         try:
             # I'm not sure why even literals, like 1, have to be specified as `ExpressionAttributeValues`.
             self._table.update_item(
-                Key={"filler": 0, "frame": num},
-                UpdateExpression="ADD in_progress :one",
-                ConditionExpression="in_progress = :current",
-                ExpressionAttributeValues={":one": 1, ":current": current}
+                Key={"shard": shard, "frame": num},
+                UpdateExpression=update_expression,
+                ConditionExpression=condition,
+                ExpressionAttributeValues=values
             )
             return True
         except self._basics.dynamodb_exceptions.ConditionalCheckFailedException:
             # If the conditional check failed then someone else beat you to updating the value.
             return False
 
+    def _frame_update(self, shard, num, update_expression, condition, values):
+        return {
+            "Update": {
+                "TableName": self._table.table_name,
+                "Key": {"shard": shard, "frame": num},
+                "UpdateExpression": update_expression,
+                "ConditionExpression": condition,
+                "ExpressionAttributeValues": values
+            }
+        }
+
+    def _acquire_all_available(self, shard, nums):
+        return self._transact_frames(
+            nums,
+            lambda n: self._frame_update(
+                shard,
+                n,
+                "SET leased = :shard, lease_expiry = :expiry, lease_owner = :owner ADD claims :one REMOVE available",
+                "attribute_exists(available)",
+                {":shard": shard, ":one": 1, ":expiry": self._lease_expiry(), ":owner": self._owner}
+            ),
+            lambda count: self._progress_update(shard, "ADD claimed :count", {":count": count})
+        )
+
+    def _acquire_expired(self, shard, num, now):
+        # The condition is re-checked against the latest value, the index may be out-of-date.
+        return self._update_lease(
+            shard,
+            num,
+            "SET lease_expiry = :expiry, lease_owner = :owner ADD claims :one",
+            "lease_expiry < :now",
+            {":one": 1, ":now": now, ":expiry": self._lease_expiry(), ":owner": self._owner}
+        )
+
+    # Renews the leases of all held frames and returns the frames whose lease turned out to have been lost.
+    def renew_leases(self):
+        return [
+            num for num, shard in self._get_held().items() if not self._update_lease(
+                shard,
+                num,
+                "SET lease_expiry = :expiry",
+                "lease_owner = :owner",
+                {":expiry": self._lease_expiry(), ":owner": self._owner}
+            )
+        ]
+
+    # Of the given held frames, whose leases have been lost, returns those that no longer exist, i.e. that another
+    # worker has completed, and stops holding them.
+    def drop_completed(self, nums):
+        lost = {num: shard for num, shard in self._get_held().items() if num in nums}
+        found = {item["frame"] for item in self._batch_get(
+            [{"shard": shard, "frame": num} for num, shard in lost.items()], "#s, #f"
+        )}
+        completed = [num for num in lost if num not in found]
+        with self._held_lock:
+            for num in completed:
+                # The frame may just have been completed by this worker too.
+                self._held.pop(num, None)
+        return completed
+
+    def _query(self, index_name, key_condition, limit=None):
+        # Index queries are always eventually consistent - the conditional updates catch any stale entries.
+        items = self._table.query(
+            IndexName=index_name,
+            KeyConditionExpression=key_condition,
+            Limit=max(self._QUERY_LIMIT, limit or 0)
+        )["Items"]
+        random.shuffle(items)
+        return items
+
+    def _query_all(self, index_name, key_condition):
+        kwargs = {"IndexName": index_name, "KeyConditionExpression": key_condition}
+        items = []
+        while True:
+            response = self._table.query(**kwargs)
+            items += response["Items"]
+            if "LastEvaluatedKey" not in response:
+                return items
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    # Looks up the items with the given keys in batches of 100 (the `BatchGetItem` limit) and returns those that
+    # exist. The projection refers to `shard` and `frame`, which are reserved words, as `#s` and `#f`.
+    def _batch_get(self, keys, projection):
+        client = self._table.meta.client
+        name = self._table.table_name
+        items = []
+        for start in range(0, len(keys), 100):
+            request = {name: {
+                "Keys": keys[start:start + 100],
+                "ProjectionExpression": projection,
+                "ExpressionAttributeNames": {"#s": "shard", "#f": "frame"}
+            }}
+            while len(request) != 0:
+                response = client.batch_get_item(RequestItems=request)
+                items += response["Responses"].get(name, [])
+                request = response["UnprocessedKeys"]
+        return items
+
+    # Returns the frames that are currently leased, each with its `shard`, `frame`, `lease_owner` and `lease_expiry`
+    # and, if set, `started` and `speculated`, e.g. so the manager can see which workers are busy. The index only
+    # holds keys, so the owners are then looked up.
+    def get_leases(self):
+        keys = []
+        for shard in range(self._shards):
+            keys += [{"shard": i["shard"], "frame": i["frame"]} for i in self._query_all(
+                self._LEASED_INDEX, Key("leased").eq(shard)
+            )]
+        leases = self._batch_get(keys, "#s, #f, lease_owner, lease_expiry, started, speculated")
+        # A lease may have been released between the query and the lookup.
+        return [lease for lease in leases if "lease_owner" in lease]
+
+    # Re-issues the given leases' frames, i.e. makes them available again while their current owners carry on
+    # rendering them. The first worker to finish completes the frame and the others abandon it. Each frame is only
+    # re-issued once and, until it's claimed again, it no longer counts as claimed.
+    # Returns the frames that were re-issued.
+    def speculate(self, leases):
+        by_shard = defaultdict(list)
+        for lease in leases:
+            by_shard[int(lease["shard"])].append(int(lease["frame"]))
+        now = int(time())
+        speculated = []
+        for shard, frames in by_shard.items():
+            speculated += self._transact_frames(
+                frames,
+                lambda n: self._frame_update(
+                    shard,
+                    n,
+                    "SET available = :shard, speculated = :now",
+                    "attribute_exists(leased) AND attribute_not_exists(available) AND attribute_not_exists(speculated)",
+                    {":shard": shard, ":now": now}
+                ),
+                lambda count: self._progress_update(shard, "ADD claimed :minus", {":minus": -count})
+            )
+        return speculated
+
+    def _claim_expired(self, shard):
+        now = int(time())
+        for i in self._query(self._LEASED_INDEX, Key("leased").eq(shard) & Key("lease_expiry").lt(now)):
+            if self._acquire_expired(shard, i["frame"], now):
+                return [i["frame"]]
+        return []
+
+    def _claim_available(self, shard):
+        while True:
+            # Fetch more candidates than needed, so workers claiming at the same time don't all go for the same ones.
+            items = self._query(self._AVAILABLE_INDEX, Key("available").eq(shard), self._batch_size * 2)
+            if len(items) == 0:
+                return []
+            # Claim frames in rank order - the items were shuffled to choose the candidates.
+            nums = [i["frame"] for i in sorted(items[:self._batch_size], key=lambda i: i["rank"])]
+            frames = self._acquire_all_available(shard, nums)
+            if len(frames) != 0:
+                return frames
+            # Every candidate was taken by other workers - query again for a fresh set.
+
+    def _claim(self):
+        shards = [(self._home_shard + offset) % self._shards for offset in range(self._shards)]
+        # Frames with expired leases, on any shard, are claimed first, so they don't end up as the job's tail.
+        for shard in shards:
+            frames = self._claim_expired(shard)
+            if len(frames) != 0:
+                return shard, frames
+        # Try the home shard first and then steal from the others.
+        for shard in shards:
+            frames = self._claim_available(shard)
+            if len(frames) != 0:
+                # Stick with the shard where frames were found rather than re-checking dry shards on every claim.
+                self._home_shard = shard
+                return shard, frames
+        return None, []
+
+    # Returns `None` only once every frame has been completed. Until then, if other workers still hold claims, this
+    # waits in case one of their leases expires (i.e. its worker is lost) and the frame needs to be rendered again.
     def get_frame(self):
-        while self._in_progress < self._MAX_IN_PROGRESS:
-            items = self._table.scan(
-                FilterExpression=Attr("in_progress").eq(self._in_progress),
-                ConsistentRead=True
-            )["Items"]
-            for i in items:
-                frame = i["frame"]
-                if self._acquire(i["frame"], i["in_progress"]):
-                    return frame
-            self._in_progress += 1
-        return None
+        while True:
+            # Skip any frames that other workers completed while they were queued (see `drop_completed`).
+            with self._held_lock:
+                while len(self._queue) != 0 and self._queue[0] not in self._held:
+                    self._queue.popleft()
+            if len(self._queue) != 0:
+                return self._queue.popleft()
+            shard, frames = self._claim()
+            if len(frames) != 0:
+                self._claimed += len(frames)
+                with self._held_lock:
+                    self._held.update({frame: shard for frame in frames})
+                self._queue.extend(frames)
+            elif self.get_remaining() == 0:
+                return None
+            else:
+                sleep(LeaseKeeper.RENEWAL_INTERVAL)
+
+    # Used to adapt the batch size, if `adaptive` is true, so that each batch takes about the same time to render.
+    def record_render_time(self, seconds):
+        if not self._adaptive:
+            return
+        if self._mean_render_time is None:
+            self._mean_render_time = seconds
+        else:
+            self._mean_render_time = self._ALPHA * seconds + (1 - self._ALPHA) * self._mean_render_time
+        size = round(self._TARGET_BATCH_SECONDS / max(self._mean_render_time, 1))
+        self._batch_size = max(1, min(size, self.MAX_BATCH_SIZE))
+
+    @property
+    def batch_size(self):
+        return self._batch_size
+
+    # Release the claims on all frames that haven't been completed, e.g. when exiting due to an error. Frames in `keep`,
+    # e.g. those that are being uploaded, are not released.
+    def release_claims(self, keep=()):
+        self._queue.clear()
+        by_shard = defaultdict(list)
+        for frame, shard in self._get_held().items():
+            if frame not in keep:
+                by_shard[shard].append(frame)
+        for shard, frames in by_shard.items():
+            released = self._transact_frames(
+                frames,
+                lambda n: self._frame_update(
+                    shard,
+                    n,
+                    "SET available = :shard REMOVE leased, lease_expiry, lease_owner",
+                    "lease_owner = :owner AND attribute_not_exists(available)",
+                    {":shard": shard, ":owner": self._owner}
+                ),
+                lambda count: self._progress_update(shard, "ADD claimed :minus", {":minus": -count})
+            )
+            # A frame that has been re-issued (see `speculate`), but not yet claimed again, is already available and
+            # no longer counts as claimed, so only the lease is removed.
+            released += [
+                frame for frame in frames if frame not in released and self._update_lease(
+                    shard,
+                    frame,
+                    "REMOVE leased, lease_expiry, lease_owner",
+                    "lease_owner = :owner AND attribute_exists(available)",
+                    {":owner": self._owner}
+                )
+            ]
+            with self._held_lock:
+                for frame in released:
+                    del self._held[frame]
+
+    def _get_held(self):
+        with self._held_lock:
+            return dict(self._held)
+
+    @property
+    def claimed(self):
+        return self._claimed
+
+
+# Report the DynamoDB calls made so far, per operation, relative to the number of frames claimed.
+def get_call_stats(basics: BotoBasics, claimed):
+    calls = basics.get_api_calls("dynamodb")
+    if claimed == 0:
+        return f"claimed no frames using {sum(calls.values())} DynamoDB calls {calls}"
+    per_frame = {op: round(count / claimed, 2) for op, count in calls.items()}
+    return f"claimed {claimed} frames, DynamoDB calls per frame {per_frame}"
+
+
+# Renews, in the background, the leases of all frames held by a `FramesTable`, e.g. while Blender is rendering. If
+# provided, `on_completed_elsewhere` is called with each held frame that another worker has completed, e.g. so that
+# its render can be cancelled.
+class LeaseKeeper:
+    RENEWAL_INTERVAL = FramesTable.LEASE_DURATION // 3
+
+    def __init__(self, frames_table: FramesTable, logger=None, on_completed_elsewhere=None):
+        self._frames_table = frames_table
+        self._logger = logger
+        self._on_completed_elsewhere = on_completed_elsewhere
+        self._stopped = Event()
+        self._thread = Thread(target=self._run, daemon=True)
+
+    def _log(self, message):
+        if self._logger is not None:
+            self._logger.info(message)
+
+    def _run(self):
+        while not self._stopped.wait(self.RENEWAL_INTERVAL):
+            try:
+                self._renew()
+            except Exception as e:
+                # E.g. throttling or a network outage. Leases are renewed well before they expire, so just try again.
+                self._log(f"failed to renew leases: {e}")
+
+    def _renew(self):
+        lost = self._frames_table.renew_leases()
+        if len(lost) == 0:
+            return
+        completed = self._frames_table.drop_completed(lost)
+        for frame in lost:
+            if frame not in completed:
+                # Another worker took over the frame, e.g. after a long network outage or because the frame was
+                # re-issued as a straggler. Whoever finishes first completes the frame.
+                self._log(f"lost lease for frame {frame}")
+        for frame in completed:
+            self._log(f"abandoning frame {frame} as another worker completed it")
+            if self._on_completed_elsewhere is not None:
+                self._on_completed_elsewhere(frame)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stopped.set()
+        self._thread.join()
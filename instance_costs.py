@@ -0,0 +1,132 @@
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+
+from boto_basics import BotoBasics
+from timings import get_render_seconds, parse_timings
+
+# Spot instances stop being charged once they start shutting down.
+_STOPPED_STATES = ["shutting-down", "terminated", "stopping", "stopped"]
+
+
+# The price in effect at any moment is the latest price change at or before that moment. The history may not reach
+# back to `start`, in which case its earliest price is assumed to have been in effect from `start`.
+def _get_spot_cost(price_history, start, end):
+    changes = sorted((item["Timestamp"], float(item["SpotPrice"])) for item in price_history)
+    if len(changes) == 0:
+        raise RuntimeError("no spot price history is available")
+    cost = 0
+    for i, (timestamp, price) in enumerate(changes):
+        period_start = start if i == 0 else max(start, timestamp)
+        period_end = end if i == len(changes) - 1 else min(end, changes[i + 1][0])
+        if period_end > period_start:
+            cost += price * (period_end - period_start).total_seconds() / 3600
+    return cost
+
+
+# Works out, from what the manager sees while monitoring the job, how long each instance was running and how that
+# time was spent:
+# * booting - from its launch until its worker logged its first message.
+# * rendering - the time its worker spent rendering frames, including starting Blender.
+# * waiting - the rest, e.g. claiming frames, uploading them and sitting idle at the end of the job.
+# An instance's end time is when it was first seen to be shutting down, so it's only accurate to within the polling
+# interval. With more than one render slot, the slots' render times are summed, so rendering is capped at the time
+# the instance was running after booting.
+class InstanceUsageTracker:
+    def __init__(self):
+        self._launch_times = {}
+        self._end_times = {}
+        self._first_event_times = {}
+        self._render_seconds = Counter()
+        self._frame_counts = Counter()
+
+    # `descriptions` are the latest descriptions of the instances and `now` is when they were retrieved.
+    def add_descriptions(self, descriptions, now):
+        for description in descriptions:
+            instance_id = description["InstanceId"]
+            self._launch_times[instance_id] = description["LaunchTime"]
+            if description["State"]["Name"] in _STOPPED_STATES and instance_id not in self._end_times:
+                self._end_times[instance_id] = now
+
+    # Each worker logs to a stream named after its instance.
+    def add_log_event(self, event):
+        instance_id = event["logStreamName"]
+        if instance_id not in self._first_event_times:
+            self._first_event_times[instance_id] = datetime.fromtimestamp(event["timestamp"] / 1000, timezone.utc)
+        timings = parse_timings(event["message"])
+        if timings is not None:
+            self._render_seconds[instance_id] += get_render_seconds(timings)
+            self._frame_counts[instance_id] += 1
+
+    # Returns the instance's running interval and its split, in seconds, into booting, rendering and waiting.
+    def _get_usage(self, instance_id, end_time):
+        launched = self._launch_times[instance_id]
+        ended = self._end_times.get(instance_id, end_time)
+        running = max((ended - launched).total_seconds(), 0)
+        booted = self._first_event_times.get(instance_id, ended)
+        boot = min(max((booted - launched).total_seconds(), 0), running)
+        rendering = min(self._render_seconds[instance_id], running - boot)
+        return launched, ended, running, (boot, rendering, running - boot - rendering)
+
+    # `instances` maps instance IDs to their placements. Each placement's instances are charged, at the spot price in
+    # effect at each moment, for the time that they were running. Any instance that was never seen to stop is charged
+    # until `end_time`. Returns a map of instance types to the frames per instance-hour that they achieved.
+    def report(self, basics: BotoBasics, instances, end_time):
+        groups = defaultdict(list)
+        for instance_id, placement in instances.items():
+            if instance_id in self._launch_times:
+                groups[placement].append(instance_id)
+
+        total_cost = 0
+        total_frames = 0
+        phase_seconds = [0.0, 0.0, 0.0]
+        phase_costs = [0.0, 0.0, 0.0]
+        type_stats = defaultdict(lambda: [0, 0.0])  # The frames and instance-hours of each type.
+        for placement, instance_ids in groups.items():
+            usages = {instance_id: self._get_usage(instance_id, end_time) for instance_id in instance_ids}
+            price_history = basics.describe_spot_price_history(
+                placement.instance_type,
+                placement.availability_zone,
+                min(launched for launched, _, _, _ in usages.values()),
+                max(ended for _, ended, _, _ in usages.values())
+            )
+            cost = 0
+            hours = 0
+            for launched, ended, running, phases in usages.values():
+                instance_cost = _get_spot_cost(price_history, launched, ended)
+                cost += instance_cost
+                hours += running / 3600
+                # The price barely changes over the life of an instance, so its cost is split in proportion to time.
+                for i, seconds in enumerate(phases):
+                    phase_seconds[i] += seconds
+                    phase_costs[i] += instance_cost * seconds / running if running > 0 else 0
+            frames = sum(self._frame_counts[instance_id] for instance_id in instance_ids)
+            total_cost += cost
+            total_frames += frames
+            print(
+                f"{len(instance_ids)} {placement.instance_type} instances in {placement.availability_zone} rendered "
+                f"{frames} frames in {hours * 60:.1f} minutes of EC2 instance time, costing US${cost:.4f}"
+            )
+            stats = type_stats[placement.instance_type]
+            stats[0] += frames
+            stats[1] += hours
+
+        frames_per_hour = {}
+        for instance_type, (frames, hours) in type_stats.items():
+            # E.g. a replacement that was launched near the end and never got to render anything says nothing about
+            # its type.
+            if frames == 0:
+                continue
+            print(f"{instance_type}: {frames / hours:.1f} frames per instance-hour")
+            frames_per_hour[instance_type] = frames / hours
+
+        total_seconds = sum(phase_seconds)
+        if total_seconds > 0:
+            breakdown = ", ".join(
+                f"{name} {seconds / total_seconds:.0%} (US${cost:.4f})"
+                for name, seconds, cost in zip(["booting", "rendering", "waiting"], phase_seconds, phase_costs)
+            )
+            print(f"Instance time was spent {breakdown}")
+        print(f"The total cost of the EC2 instance time is US${total_cost:.4f}")
+        if total_frames != 0:
+            print(f"That's US${total_cost / total_frames:.4f} per frame")
+        return frames_per_hour
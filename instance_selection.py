@@ -0,0 +1,51 @@
+from collections import namedtuple
+from datetime import datetime, timezone
+
+from blend_cache import get_cached, set_cached
+from boto_basics import BotoBasics
+
+# Where an instance is launched, i.e. its type and availability zone.
+Placement = namedtuple("Placement", ["instance_type", "availability_zone"])
+
+# The frames per instance-hour achieved by each instance type is cached per .blend file, as it depends on the scene.
+_FRAMES_PER_HOUR = "frames_per_hour"
+
+
+# Returns a map of availability zones to the current spot price, per hour, of the given instance type. Zones where the
+# type isn't offered are missing.
+def get_current_spot_prices(basics: BotoBasics, instance_type, availability_zones=None):
+    prices = {}
+    for item in basics.describe_spot_price_history(instance_type, None, datetime.now(timezone.utc)):
+        zone = item["AvailabilityZone"]
+        if availability_zones is None or zone in availability_zones:
+            # If the price has just changed, there can be more than one entry - assume the worst.
+            prices[zone] = max(prices.get(zone, 0), float(item["SpotPrice"]))
+    return prices
+
+
+# Ranks every combination of instance type and availability zone by expected frames per dollar, i.e. the frames per
+# hour measured for the type, in earlier jobs for the same .blend file, divided by the current spot price. Types that
+# haven't been measured yet come after those that have, in the order given in `instance_types`, and within each type
+# the cheapest zones come first.
+def rank_placements(basics: BotoBasics, blend_file, instance_types, availability_zones=None):
+    frames_per_hour = get_cached(blend_file, _FRAMES_PER_HOUR) or {}
+    measured = []
+    unmeasured = []
+    for instance_type in instance_types:
+        prices = get_current_spot_prices(basics, instance_type, availability_zones)
+        for zone, price in sorted(prices.items(), key=lambda item: item[1]):
+            placement = Placement(instance_type, zone)
+            if instance_type in frames_per_hour:
+                measured.append((frames_per_hour[instance_type] / price, placement))
+            else:
+                unmeasured.append(placement)
+    # Python's sort is stable, so equally good placements stay in order.
+    measured.sort(key=lambda item: item[0], reverse=True)
+    return [placement for _, placement in measured] + unmeasured
+
+
+# `frames_per_hour` maps instance types to the frames per instance-hour measured in the job just completed. Types that
+# weren't used keep their earlier measurements.
+def record_frames_per_hour(blend_file, frames_per_hour):
+    cached = get_cached(blend_file, _FRAMES_PER_HOUR) or {}
+    set_cached(blend_file, _FRAMES_PER_HOUR, {**cached, **frames_per_hour})
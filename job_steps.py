@@ -6,10 +6,14 @@ from mypy_boto3_s3.service_resource import Bucket
 
 from boto_basics import get_s3_uri
 from frames_table import FramesTable
+from result_downloader import ResultDownloader
+from tiles import stitch_tiles
 
 USER_DATA = "user_data"
 
 _START_JOB = "start_job"
+# Uploaded after all the other job files - `user_data` waits for it, as instances may be launched before the upload.
+_JOB_FILES_READY = "job_files_ready"
 _WORKER_FILES = "json_files/worker_files.json"
 _TEMPORARY_FILES = "json_files/temporary_files.json"
 
@@ -21,17 +25,25 @@ def _substitute(filename, **kwargs):
     Path(filename).write_text(content)
 
 
-def create_worker_files(job_id, bucket_name, file_store, blender_archive, samples, motion_blur):
+# `user_data` only depends on the bucket name, so it's created separately and instances can be launched early.
+def create_user_data(bucket_name):
+    _substitute(USER_DATA, bucket_name=bucket_name, job_files_ready=_JOB_FILES_READY)
+
+
+def create_start_job(job_id, file_store, bootstrap_bundle, packed_blend, samples, motion_blur, claim_batch, shards, tiles):
     motion_blur_condition = "enable" if motion_blur else "disable"
     _substitute(
         _START_JOB,
         file_store=file_store,
-        blender_archive=blender_archive,
+        bootstrap_bundle=bootstrap_bundle,
+        packed_blend=packed_blend,
         samples=samples,
         motion_blur_condition=motion_blur_condition,
-        render_job_id=job_id
+        render_job_id=job_id,
+        claim_batch=claim_batch,
+        shards=shards,
+        tiles=tiles
     )
-    _substitute(USER_DATA, bucket_name=bucket_name)
 
 
 def delete_temporary_files():
@@ -45,35 +57,40 @@ def upload_worker_files(bucket: Bucket):
     filenames = json.loads(Path(_WORKER_FILES).read_text())
     for filename in filenames:
         bucket.upload_file(filename, filename)
+    bucket.put_object(Key=_JOB_FILES_READY, Body=b"")
     print(f"Uploaded job files to {get_s3_uri(bucket)}")
 
 
-def create_db_table(basics, table_name, frames):
-    frames_table = FramesTable(basics, table_name)
-    frames_table.create(frames)
-    print(f"Created DynamoDB table {table_name}")
+# In tile mode, `items` are tiles rather than frames (see `tiles.get_items`). If the table already `exists`, e.g. it
+# came from the resource pool, it's just populated.
+def create_db_table(basics, table_name, items, shards, costs=None, exists=False):
+    frames_table = FramesTable(basics, table_name, shards=shards)
+    if exists:
+        frames_table.populate(items, costs)
+        print(f"Populated DynamoDB table {table_name} with {shards} shard(s)")
+    else:
+        frames_table.create(items, costs)
+        print(f"Created DynamoDB table {table_name} with {shards} shard(s)")
     return frames_table
 
 
-def _download_objects(bucket, keys, output_dir):
-    print("Downloading images ", end="")
-    for key in keys:
-        obj = bucket.Object(key)
-        filename = key.split("/")[-1]
-        obj.download_file(f"{output_dir}/{filename}")
-        print(".", end="", flush=True)
-
-    print()  # Add newline after dots.
-    return len(keys)
-
-
-def download_results(basics, job_id, bucket, remote_dir):
+# Frames are downloaded while the job runs (see `ResultDownloader.poll`).
+def create_result_downloader(basics, job_id, bucket, remote_dir):
     output_dir = f"results/{job_id}"
     Path(output_dir).mkdir(parents=True, exist_ok=True)
+    return ResultDownloader(basics, bucket.name, remote_dir, output_dir)
+
 
-    keys = basics.list_objects(bucket.name, remote_dir)
-    count = _download_objects(bucket, keys, output_dir)
+# Returns the number of frames downloaded. In tile mode, the tiles are stitched into frames and the number of
+# frames stitched is returned.
+def download_results(downloader: ResultDownloader, blender, tiles):
+    output_dir = downloader.output_dir
+    count = downloader.finish()
 
     print(f"Downloaded {count} files to {output_dir}")
 
+    if tiles != 1:
+        count = stitch_tiles(blender, output_dir, tiles)
+        print(f"Stitched {count} frames in {output_dir}")
+
     return count
@@ -1,5 +1,6 @@
+import statistics
 import time
-from collections import defaultdict
+from collections import deque
 from datetime import datetime, timezone
 
 from boto_basics import BotoBasics
@@ -9,9 +10,31 @@ from boto_basics import BotoBasics
 class LogsRetriever:
     _START_OFFSET = 60  # Look at most 60s into the past when making the initial request for log entries.
 
+    # Events can become visible out of order, e.g. an event logged by one worker can show up just after a later event
+    # logged by another. So, each new query reaches this far back, in milliseconds, before the newest event seen so
+    # far and events that have already been seen are filtered out.
+    _LOOKBACK = 5000
+
+    # The IDs of the events seen within the lookback period are remembered, but never more than this many. If more
+    # events than this are logged within the lookback period, a few may be shown twice.
+    _MAX_SEEN_EVENTS = 10000
+
+    # If events are being logged faster than they can be retrieved, a single call stops after this many pages and the
+    # next call carries on where it left off.
+    _MAX_PAGES = 100
+
+    # The lags, between an event being logged and displayed, that are kept for the report at the end.
+    _MAX_LAGS = 10000
+
+    # Warn if events are being displayed more than this many seconds after they were logged.
+    _LAG_WARNING = 30
+
     def __init__(self):
         self._next_token = None
-        self.event_ids_per_timestamp = defaultdict(set)
+        self._seen = {}  # Maps event IDs to their timestamps.
+        self._newest_timestamp = None
+        self._lags = deque(maxlen=self._MAX_LAGS)
+        self._behind = False
 
         self._start_time = int((time.time() - self._START_OFFSET) * 1000)
 
@@ -25,30 +48,58 @@ class LogsRetriever:
         # This rather complicated conversion switches from UTC to local time and then drops the '+02:00' portion.
         return dt.astimezone(None).replace(tzinfo=None).isoformat(" ", timespec)
 
+    # Forget the IDs of events that are now too old to be returned again, and the oldest ones if there are still too
+    # many. Events aren't necessarily seen in timestamp order, so they're pruned by their timestamps.
+    def _prune_seen(self):
+        cutoff = self._newest_timestamp - self._LOOKBACK
+        seen = {event_id: timestamp for event_id, timestamp in self._seen.items() if timestamp >= cutoff}
+        if len(seen) > self._MAX_SEEN_EVENTS:
+            newest = sorted(seen.items(), key=lambda item: item[1])[-self._MAX_SEEN_EVENTS:]
+            seen = dict(newest)
+        self._seen = seen
+
+    # Returns all the events logged since the last call, up to `_MAX_PAGES` pages of them, in timestamp order.
     def get_log_events(self, basics: BotoBasics, group_name):
         log_events = []
 
-        response = basics.filter_log_events(group_name, self._start_time, self._next_token)
-
-        for event in response["events"]:
-            # Filter out event IDs that have already been seen.
-            if event["eventId"] not in self.event_ids_per_timestamp[event["timestamp"]]:
-                self.event_ids_per_timestamp[event["timestamp"]].add(event["eventId"])
-                log_events.append(event)
-
-        # Keep only IDs of the events with the newest timestamp.
-        newest_timestamp = None
-        if len(self.event_ids_per_timestamp) != 0:
-            newest_timestamp = max(self.event_ids_per_timestamp.keys())
-            ids = self.event_ids_per_timestamp[newest_timestamp]
-            self.event_ids_per_timestamp = defaultdict(set, {newest_timestamp: ids})
-
-        if "nextToken" in response:
-            self._next_token = response["nextToken"]
-        else:
-            # Remove nextToken and update startTime for the next request with the timestamp of the newest event.
-            if newest_timestamp is not None:
-                self._start_time = newest_timestamp
-            self._next_token = None
+        for _ in range(self._MAX_PAGES):
+            response = basics.filter_log_events(group_name, self._start_time, self._next_token)
 
+            for event in response["events"]:
+                # Filter out events that have already been seen.
+                if event["eventId"] not in self._seen:
+                    self._seen[event["eventId"]] = event["timestamp"]
+                    log_events.append(event)
+                    if self._newest_timestamp is None or event["timestamp"] > self._newest_timestamp:
+                        self._newest_timestamp = event["timestamp"]
+
+            self._next_token = response.get("nextToken")
+            if self._next_token is None:
+                break
+
+        if self._newest_timestamp is not None:
+            self._prune_seen()
+            if self._next_token is None:
+                # Start the next set of requests shortly before the newest event.
+                self._start_time = max(self._start_time, self._newest_timestamp - self._LOOKBACK)
+
+        log_events.sort(key=lambda e: e["timestamp"])
         return log_events
+
+    # Should be called once the events have been displayed, to track how far behind real time the display is.
+    def record_displayed(self, log_events):
+        now = time.time() * 1000
+        lags = [(now - event["timestamp"]) / 1000 for event in log_events]
+        self._lags.extend(lags)
+        behind = len(lags) != 0 and max(lags) > self._LAG_WARNING
+        if behind and not self._behind:
+            print(f"Warning: log events are being displayed up to {max(lags):.0f}s after they were logged")
+        self._behind = behind
+
+    def report_lag(self):
+        if len(self._lags) == 0:
+            return
+        print(
+            f"Log events were displayed a median of {statistics.median(self._lags):.1f}s, and at most "
+            f"{max(self._lags):.1f}s, after they were logged"
+        )
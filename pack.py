@@ -1,12 +1,27 @@
+import hashlib
 import os
+import textwrap
 
+from blend_cache import hash_blend_file
 from blender import run_blender
+from boto_basics import BotoBasics, get_s3_uri
+from utils import hash_file, sizeof_fmt
 
+# Packed .blend files are stored in the file store under a key derived from the content of the .blend file and all
+# the files, e.g. textures, that it depends on. So, a scene that hasn't changed since the last job isn't packed and
+# uploaded again.
+_PACKED_PREFIX = "packed"
 
-def pack_blend_file(blender, input_file, output_file):
+PACKED_BLEND_FILE = "packed.blend"
+
+
+# Returns the Blender Python code that packs the loaded .blend file to `output_file`. It's already dedented, so it can
+# be appended to other code, e.g. to pack the .blend file in the same session that inspects it (see
+# `get_scene_attributes`).
+def get_pack_code(output_file):
     # Blender will fail if the output path is not absolute.
     output_file = os.path.abspath(output_file)
-    code = f"""
+    return textwrap.dedent(f"""
         import sys
         import traceback
         import bpy
@@ -19,6 +34,39 @@ def pack_blend_file(blender, input_file, output_file):
             traceback.print_exc()
             # Force Blender to exit with a non-zero exit code.
             sys.exit(1)
-    """
+    """)
+
+
+def pack_blend_file(blender, input_file, output_file):
     # Output is just captured to silence it (but it's printed if an error occurs).
-    run_blender(blender, input_file, code, capture_output=True)
+    run_blender(blender, input_file, get_pack_code(output_file), capture_output=True)
+
+
+# A missing dependency is hashed as such, rather than being an error here, so that packing can report it.
+def _get_cache_key(blend_file, dependencies):
+    sha256 = hashlib.sha256(hash_blend_file(blend_file).encode())
+    for path in dependencies:
+        file_hash = hash_file(path) if os.path.isfile(path) else "missing"
+        sha256.update(f"\n{path} {file_hash}".encode())
+    return sha256.hexdigest()
+
+
+# Returns the key, in the file store, of the packed version of the .blend file. `dependencies` are the absolute paths
+# of the files that the .blend file depends on (see `get_scene_attributes`). If there isn't a packed version already,
+# the .blend file is uploaded from `packed_file`, packing it first if this hasn't already been done.
+def get_packed_blend_file(basics: BotoBasics, blender, blend_file, dependencies, file_store, packed_file):
+    key = f"{_PACKED_PREFIX}/{_get_cache_key(blend_file, dependencies)}.blend"
+    store = basics.get_bucket(file_store[5:])
+    packed = store.Object(key)
+    if basics.object_exists(packed):
+        print(f"Using the already packed .blend file {get_s3_uri(packed)}")
+        return key
+
+    if not os.path.isfile(packed_file):
+        pack_blend_file(blender, blend_file, packed_file)
+    size = sizeof_fmt(os.path.getsize(packed_file))
+    print(f"Packed the .blend file to {size} (compressed)")
+    packed.upload_file(packed_file)
+    print(f"Uploaded the packed .blend file to {get_s3_uri(packed)}")
+
+    return key
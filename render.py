@@ -1,45 +1,297 @@
 import os.path
 import glob
+import json
+import time
+from threading import Lock
 
-from blender import run_blender
+from blender import run_blender, start_blender, dump_dict, recover_dict_from_line
+from render_progress import parse_sample_line
+from render_slots import RenderSlot
+from timings import PhaseTimings
 
 _CYCLES_DEVICE = "OPTIX"
 
 
-def _get_python_expr(samples, motion_blur):
+# `border`, if not `None`, is a region of the frame as `[min_x, max_x, min_y, max_y]`, with each value a fraction of
+# the frame size. Only that region is rendered and the output is cropped to it, i.e. the output is a tile.
+def _get_python_expr(samples, motion_blur, border=None):
     return f"""
         import bpy
 
         scene = bpy.context.scene
         scene.cycles.samples = {samples}
         scene.render.use_motion_blur = {motion_blur}
+
+        def set_border(border):
+            render = scene.render
+            render.use_border = True
+            render.use_crop_to_border = True
+            render.border_min_x, render.border_max_x, render.border_min_y, render.border_max_y = border
+
+        if {border} is not None:
+            set_border({border})
     """
 
 
-def render_blend_file_frame(blender, input_file, samples, motion_blur, frame, output_prefix="frame-"):
+def _get_output_files(output_prefix):
+    return set(glob.iglob(glob.escape(output_prefix) + "*"))
+
+
+def _check_output_prefix(output_prefix):
     if os.path.isabs(output_prefix):
         raise RuntimeError(f"absolute output prefixes are not supported - {output_prefix}")
 
-    def get_output_files():
-        return set(glob.iglob(glob.escape(output_prefix) + "*"))
-
-    existing = get_output_files()
+    existing = _get_output_files(output_prefix)
     if len(existing) != 0:
         # Frames, that were not deleted after being uploaded, have been left lying around.
         raise RuntimeError(f"frame(s) {existing} must be removed")
 
-    run_blender(blender, input_file, _get_python_expr(samples, motion_blur), [
+
+# Blender processes its arguments in order, so `--threads` must come before anything, like `-f`, that renders.
+def _get_threads_args(threads):
+    return ["--threads", str(threads)] if threads is not None else []
+
+
+def render_blend_file_frame(
+    blender,
+    input_file,
+    samples,
+    motion_blur,
+    frame,
+    output_prefix="frame-",
+    device=_CYCLES_DEVICE,
+    env=None,
+    threads=None,
+    border=None
+):
+    _check_output_prefix(output_prefix)
+
+    run_blender(blender, input_file, _get_python_expr(samples, motion_blur, border), _get_threads_args(threads) + [
         "-E", "CYCLES",
         "-o", f"//{output_prefix}",
         "-f", str(frame),
         "--",
-        "--cycles-device", _CYCLES_DEVICE
-    ])
+        "--cycles-device", device
+    ], env=env)
 
-    output_file = get_output_files()
+    output_file = _get_output_files(output_prefix)
 
     if len(output_file) != 1:
         # Maybe multiple workers are accidentally running concurrently.
         raise RuntimeError("couldn't determine output file")
 
     return next(iter(output_file))
+
+
+# The Python code run by a persistent Blender process. It reads requests, one JSON object per line, from stdin and,
+# for each, renders the requested frame, or just its border, and reports the output file. `use_persistent_data`
+# keeps data, like the BVH, around between renders, so only the first frame pays for loading the .blend file and
+# building everything.
+#
+# Once the .blend file is loaded, the wall-clock time is reported so that the startup time can be worked out. And
+# the time taken by each phase of a render is reported with the output file. Cycles reports its progress via the
+# `render_stats` handler, so the first mention of a sample marks the end of syncing the scene, e.g. building the
+# BVH, and the start of path tracing. Path tracing is timed up to the end of writing the output file.
+def _get_server_python_expr(samples, motion_blur, output_prefix):
+    return f"""
+        {_get_python_expr(samples, motion_blur)}
+        import json
+        import os
+        import sys
+        import time
+        import traceback
+
+        scene.render.engine = "CYCLES"
+        scene.render.use_persistent_data = True
+        scene.render.filepath = "//{output_prefix}"
+
+        first_sample = None
+
+        def on_render_stats(stats):
+            global first_sample
+            if first_sample is None and "Sample" in stats:
+                first_sample = time.perf_counter()
+
+        bpy.app.handlers.render_stats.append(on_render_stats)
+
+        ready = {{"ready": time.time()}}
+        {dump_dict("ready")}
+
+        for line in sys.stdin:
+            try:
+                request = json.loads(line)
+                frame = request["frame"]
+                if request["border"] is not None:
+                    set_border(request["border"])
+                start = time.perf_counter()
+                scene.frame_set(frame)
+                frame_set = time.perf_counter()
+                first_sample = None
+                bpy.ops.render.render(write_still=True)
+                end = time.perf_counter()
+                timings = {{"frame_set": frame_set - start}}
+                if first_sample is not None:
+                    timings["sync"] = first_sample - frame_set
+                    timings["path_tracing"] = end - first_sample
+                else:
+                    timings["render"] = end - frame_set
+                output_file = os.path.relpath(bpy.path.abspath(scene.render.frame_path(frame=frame)))
+                result = {{"output_file": output_file, "timings": timings}}
+            except Exception:
+                traceback.print_exc()
+                result = {{"error": traceback.format_exc()}}
+            {dump_dict("result")}
+    """
+
+
+# Raised when a render is aborted, e.g. due to a spot interruption.
+class RenderAborted(RuntimeError):
+    pass
+
+
+# Raised when the render of a single frame is cancelled, e.g. because another worker has already completed it.
+class RenderCancelled(RuntimeError):
+    pass
+
+
+# A long-lived Blender process that renders frames on request. If provided, `on_progress` is called with the frame,
+# the current sample and the total number of samples as Blender reports its progress.
+class PersistentRenderer:
+    def __init__(self, blender, input_file, samples, motion_blur, slot: RenderSlot, on_progress=None):
+        self._on_progress = on_progress
+        code = _get_server_python_expr(samples, motion_blur, slot.output_prefix)
+        self._start_time = time.time()
+        self._process = start_blender(
+            blender,
+            input_file,
+            code,
+            _get_threads_args(slot.threads) + ["--", "--cycles-device", slot.device],
+            env=slot.env
+        )
+
+    # The time taken by each phase of the render is added to `timings`. The first render also includes the time
+    # taken to start Blender and load the .blend file.
+    def render(self, frame, timings: PhaseTimings, border=None):
+        if self._process.poll() is not None:
+            raise RuntimeError(f"Blender exited with code {self._process.returncode}")
+
+        self._process.stdin.write(json.dumps({"frame": frame, "border": border}) + "\n")
+        self._process.stdin.flush()
+
+        # Blender's own output, e.g. its progress lines, is interleaved with the result.
+        for line in self._process.stdout:
+            result = recover_dict_from_line(line)
+            if result is None:
+                progress = parse_sample_line(line)
+                if progress is not None and self._on_progress is not None:
+                    self._on_progress(frame, *progress)
+                continue
+            if "ready" in result:
+                timings.add("startup", result["ready"] - self._start_time)
+                continue
+            if "error" in result:
+                raise RuntimeError(f"failed to render frame {frame} - {result['error']}")
+            output_file = result["output_file"]
+            if not os.path.isfile(output_file):
+                raise RuntimeError(f"output file {output_file} does not exist")
+            for phase, seconds in result["timings"].items():
+                timings.add(phase, seconds)
+            return output_file
+
+        raise RuntimeError(f"Blender exited with code {self._process.wait()}")
+
+    def close(self):
+        if self._process.poll() is None:
+            # Closing stdin ends the server loop and Blender then exits normally.
+            self._process.stdin.close()
+            self._process.wait()
+
+    def kill(self):
+        self._process.kill()
+        self._process.wait()
+
+
+# Renders frames with a `PersistentRenderer` and, if it fails, falls back to starting Blender for every frame.
+# Progress is only reported while the `PersistentRenderer` is in use.
+class FrameRenderer:
+    def __init__(self, blender, input_file, samples, motion_blur, slot: RenderSlot, log=print, on_progress=None):
+        self._args = (blender, input_file, samples, motion_blur)
+        self._slot = slot
+        self._output_prefix = slot.output_prefix
+        self._log = log
+        self._on_progress = on_progress
+        self._persistent = PersistentRenderer(blender, input_file, samples, motion_blur, slot, on_progress)
+        self._aborted = False
+        self._lock = Lock()
+        self._current = None
+        self._cancelled = None
+
+    # Replaces a persistent Blender process that was killed to cancel a render.
+    def _restart_if_cancelled(self):
+        with self._lock:
+            if self._cancelled is None:
+                return
+            self._cancelled = None
+            self._persistent = PersistentRenderer(*self._args, self._slot, self._on_progress)
+        # Remove any partial output of the cancelled render.
+        for filename in _get_output_files(self._output_prefix):
+            os.unlink(filename)
+
+    def render(self, frame, timings: PhaseTimings, border=None):
+        if self._aborted:
+            raise RenderAborted(f"not rendering frame {frame} as rendering has been aborted")
+        if self._persistent is not None:
+            self._restart_if_cancelled()
+            _check_output_prefix(self._output_prefix)
+            with self._lock:
+                self._current = (frame, border)
+            try:
+                return self._persistent.render(frame, timings, border)
+            except (RuntimeError, OSError) as e:
+                if self._aborted:
+                    raise RenderAborted(f"aborted rendering frame {frame}") from e
+                if self._cancelled == (frame, border):
+                    raise RenderCancelled(f"cancelled rendering frame {frame}") from e
+                self._log(f"persistent Blender failed, falling back to one Blender process per frame - {e}")
+                self._persistent.kill()
+                self._persistent = None
+                # Remove any partial output, so it doesn't block the fallback.
+                for filename in _get_output_files(self._output_prefix):
+                    os.unlink(filename)
+            finally:
+                with self._lock:
+                    self._current = None
+        slot = self._slot
+        # Blender's startup can't be separated from the render when it's started for every frame.
+        with timings.phase("blender"):
+            return render_blend_file_frame(
+                *self._args, frame, slot.output_prefix, slot.device, slot.env, slot.threads, border
+            )
+
+    # Can be called from another thread. Kills Blender, so that the current render fails with `RenderAborted`, as
+    # will any later render. A Blender process started for a single frame, by the fallback, is left to finish.
+    def abort(self):
+        self._aborted = True
+        persistent = self._persistent
+        if persistent is not None:
+            persistent.kill()
+
+    # Can be called from another thread. If the persistent Blender process is rendering the given frame, or the given
+    # border of it, then it's killed, so that the render fails with `RenderCancelled`, and a new process is started
+    # for the next render. A Blender process started for a single frame, by the fallback, is left to finish.
+    def cancel(self, frame, border=None):
+        with self._lock:
+            if self._current != (frame, border) or self._persistent is None:
+                return
+            self._cancelled = (frame, border)
+            self._persistent.kill()
+
+    def close(self):
+        if self._persistent is not None:
+            self._persistent.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
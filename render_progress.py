@@ -0,0 +1,100 @@
+import json
+import re
+from collections import defaultdict
+from datetime import datetime, timedelta
+from time import time
+from timeit import default_timer as timer
+
+from utils import timedelta_fmt
+
+# Workers log the progress of the frame being rendered as a JSON record that follows this marker.
+_MARKER = "PROGRESS>"
+
+# Cycles reports its progress with lines like "Fra:1 Mem:35.97M ... | Scene, ViewLayer | Sample 12/128".
+_SAMPLE_MATCHER = re.compile(r"Sample (\d+)/(\d+)")
+
+# Each render slot logs its progress at most this often, to keep the number of CloudWatch calls down.
+_REPORTING_INTERVAL = 15
+# The manager prints throughput and ETA at most this often.
+_PRINTING_INTERVAL = 30
+# Slots that haven't reported for this long are assumed to be idle, or gone, and are ignored.
+_STALE_SECONDS = 4 * _REPORTING_INTERVAL
+
+
+# Returns the current sample and the total number of samples, or `None` if the line isn't a progress line.
+def parse_sample_line(line):
+    match = _SAMPLE_MATCHER.search(line)
+    return (int(match.group(1)), int(match.group(2))) if match is not None else None
+
+
+# Logs the samples per second achieved on the frame being rendered by a slot. Nothing is logged until the rate
+# can be worked out, i.e. until a frame has progressed past the first sample seen.
+class ProgressReporter:
+    def __init__(self, logger, slot_name):
+        self._logger = logger
+        self._slot_name = slot_name
+        self._frame = None
+        self._start = None
+        self._last_report = None
+
+    def on_progress(self, frame, sample, samples):
+        now = timer()
+        if frame != self._frame:
+            self._frame = frame
+            self._start = (now, sample)
+            return
+        if self._last_report is not None and now - self._last_report < _REPORTING_INTERVAL:
+            return
+        start_time, start_sample = self._start
+        if sample <= start_sample:
+            return
+        self._last_report = now
+        record = {
+            "slot": self._slot_name,
+            "frame": frame,
+            "sample": sample,
+            "samples": samples,
+            "samples_per_second": (sample - start_sample) / (now - start_time)
+        }
+        self._logger.info(f"{_MARKER} {json.dumps(record)}")
+
+
+# Collects the progress records logged by the workers and prints the throughput of each instance along with an
+# estimate of when the job will finish. The estimate assumes the frames still to be rendered will be rendered at
+# the current overall rate of samples per second.
+class ProgressMonitor:
+    def __init__(self, samples):
+        self._samples = samples
+        self._latest = {}  # Maps each instance and slot to the time and content of its latest record.
+        self._last_print = None
+
+    # Returns `True` if the event was a progress record.
+    def add(self, event):
+        message = event["message"]
+        if not message.startswith(_MARKER):
+            return False
+        record = json.loads(message[len(_MARKER):])
+        self._latest[(event["logStreamName"], record["slot"])] = (time(), record)
+        return True
+
+    # `remaining` is the number of frames that haven't yet been completed, including those being rendered.
+    def print_estimate(self, remaining):
+        now = time()
+        if self._last_print is not None and now - self._last_print < _PRINTING_INTERVAL:
+            return
+        live = [(key, record) for key, (received, record) in self._latest.items() if now - received < _STALE_SECONDS]
+        if len(live) == 0:
+            return
+        self._last_print = now
+
+        rates = defaultdict(float)
+        for (instance_id, _), record in live:
+            rates[instance_id] += record["samples_per_second"]
+        total_rate = sum(rates.values())
+        rates_str = ", ".join(f"{instance_id} {rate:.1f}" for instance_id, rate in sorted(rates.items()))
+        print(f"{datetime.now()} Samples/sec: {rates_str} (total {total_rate:.1f})")
+
+        # Samples already rendered for the frames in progress don't need to be rendered again.
+        remaining_samples = max(remaining * self._samples - sum(record["sample"] for _, record in live), 0)
+        eta = timedelta(seconds=remaining_samples / total_rate)
+        print(f"{datetime.now()} Estimated time remaining: {timedelta_fmt(eta)}")
@@ -0,0 +1,44 @@
+import os
+import subprocess
+from collections import namedtuple
+
+# A slot renders one frame at a time on its own device. `env` holds additional environment variables for Blender,
+# e.g. to pin it to a single GPU, and `threads` limits the number of CPU threads (`None` means use all of them).
+RenderSlot = namedtuple("RenderSlot", ["name", "device", "env", "threads", "output_prefix"])
+
+_GPU_DEVICE = "OPTIX"
+
+# Only add a CPU slot if there are enough cores that it doesn't starve the GPU slots. Each GPU slot needs a couple
+# of cores to keep its GPU fed.
+_MIN_CPU_SLOT_THREADS = 8
+_THREADS_PER_GPU = 2
+
+
+def _count_gpus():
+    try:
+        completed = subprocess.run(["nvidia-smi", "--list-gpus"], check=True, capture_output=True, text=True)
+    except (OSError, subprocess.CalledProcessError):
+        return 0
+    return len([line for line in completed.stdout.splitlines() if line.startswith("GPU ")])
+
+
+def _output_prefix(name):
+    # Each slot renders into its own subdirectory, so the output files still have the usual names.
+    return f"{name}/frame-"
+
+
+def detect_render_slots(cpu_slot=None):
+    gpu_count = _count_gpus()
+    slots = [
+        RenderSlot(f"gpu{i}", _GPU_DEVICE, {"CUDA_VISIBLE_DEVICES": str(i)}, None, _output_prefix(f"gpu{i}"))
+        for i in range(gpu_count)
+    ]
+
+    spare_threads = os.cpu_count() - gpu_count * _THREADS_PER_GPU
+    if cpu_slot is None:
+        cpu_slot = gpu_count == 0 or spare_threads >= _MIN_CPU_SLOT_THREADS
+    if cpu_slot:
+        threads = max(spare_threads, 1) if gpu_count != 0 else None
+        slots.append(RenderSlot("cpu", "CPU", None, threads, _output_prefix("cpu")))
+
+    return slots
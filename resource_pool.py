@@ -0,0 +1,153 @@
+from threading import Thread
+from time import time
+from uuid import uuid4
+
+from boto3.dynamodb.conditions import Attr
+
+from boto_basics import BotoBasics
+from boto_basics import create_key_schema_element as table_key
+from boto_basics import create_attribute_definition as table_attr
+from frames_table import FramesTable
+from names import Names
+
+# Creating a job's DynamoDB table, and deleting it again, each take about 20s. So, sets of job resources, i.e. a
+# table, bucket and log group, are created in advance and kept in a pool. A job checks out a set and, once the job is
+# done, the set is reset, i.e. emptied, and returned to the pool rather than being deleted. Each set is named, with
+# `Names`, after its own ID rather than the ID of the job using it.
+#
+# The pool is tracked in a registry table with an item per set. The registry is created the first time the pool is
+# used and is then left in place, like the file store.
+POOL_TABLE = "render-job-pool"
+
+_CREATING = "creating"
+_AVAILABLE = "available"
+_IN_USE = "in_use"
+
+
+# Each method creates its own `BotoBasics` as they may be called from different threads and boto3 resources aren't
+# thread safe.
+class ResourcePool:
+    def __init__(self, size):
+        self._size = size
+        self._threads = []
+        self._create_registry()
+
+    @staticmethod
+    def _get_registry(basics):
+        return basics.get_table(POOL_TABLE)
+
+    def _create_registry(self):
+        basics = BotoBasics()
+        registry = self._get_registry(basics)
+        try:
+            registry.load()
+        except basics.dynamodb_exceptions.ResourceNotFoundException:
+            try:
+                basics.create_table(POOL_TABLE, [table_key("set_id", "HASH")], [table_attr("set_id", "S")])
+            except basics.dynamodb_exceptions.ResourceInUseException:
+                # Another manager is creating it at the same time.
+                registry.wait_until_exists()
+
+    @staticmethod
+    def get_sets(basics):
+        registry = ResourcePool._get_registry(basics)
+        kwargs = {"ConsistentRead": True}
+        sets = []
+        while True:
+            response = registry.scan(**kwargs)
+            sets += response["Items"]
+            if "LastEvaluatedKey" not in response:
+                return sets
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    # Removes the sets that aren't available from the registry and returns the IDs of the sets that are. It's only
+    # used by `clean_up.py`, when no jobs are running, so any set that isn't available is left over from a job, or
+    # creation, that didn't finish.
+    @staticmethod
+    def prune(basics):
+        registry = ResourcePool._get_registry(basics)
+        available = []
+        for item in ResourcePool.get_sets(basics):
+            if item["state"] == _AVAILABLE:
+                available.append(item["set_id"])
+            else:
+                registry.delete_item(Key={"set_id": item["set_id"]})
+        return available
+
+    def _set_state(self, basics, set_id, state, expected=None, **attributes):
+        # Placeholders are used for all the attribute names as some, e.g. "state", are DynamoDB reserved words.
+        attributes = {"state": state, **attributes}
+        assignments = ", ".join(f"#{name} = :{name}" for name in attributes)
+        kwargs = {}
+        if expected is not None:
+            kwargs["ConditionExpression"] = Attr("state").eq(expected)
+        self._get_registry(basics).update_item(
+            Key={"set_id": set_id},
+            UpdateExpression=f"SET {assignments}",
+            ExpressionAttributeNames={f"#{name}": name for name in attributes},
+            ExpressionAttributeValues={f":{name}": value for name, value in attributes.items()},
+            **kwargs
+        )
+
+    # Returns the ID of the checked out set or `None` if there are no available sets. The conditional update means
+    # two managers can't check out the same set.
+    def check_out(self, job_id):
+        basics = BotoBasics()
+        for item in self.get_sets(basics):
+            if item["state"] != _AVAILABLE:
+                continue
+            try:
+                self._set_state(basics, item["set_id"], _IN_USE, _AVAILABLE, job_id=str(job_id), since=int(time()))
+            except basics.dynamodb_exceptions.ConditionalCheckFailedException:
+                continue  # Another manager got there first.
+            print(f"Checked out resource set {item['set_id']} from the pool")
+            return item["set_id"]
+        return None
+
+    def _create_set(self):
+        basics = BotoBasics()
+        set_id = str(uuid4())
+        names = Names(set_id)
+        # The set is registered first, so that `clean_up.py` can find it even if creating it fails part way through.
+        self._get_registry(basics).put_item(Item={"set_id": set_id, "state": _CREATING, "since": int(time())})
+        basics.create_log_group(names.log_group)
+        basics.create_bucket(names.bucket)
+        FramesTable(basics, names.dynamodb).create_table()
+        self._set_state(basics, set_id, _AVAILABLE)
+        print(f"Added resource set {set_id} to the pool")
+
+    # Sets that are still being created count towards the size, so concurrent managers don't all top up the pool.
+    # They can still race, in which case the pool just ends up a little bigger than intended.
+    def _get_shortfall(self):
+        sets = self.get_sets(BotoBasics())
+        return self._size - sum(1 for item in sets if item["state"] in [_CREATING, _AVAILABLE])
+
+    def _reset(self, set_id):
+        basics = BotoBasics()
+        names = Names(set_id)
+        FramesTable(basics, names.dynamodb).clear()
+        basics.empty_bucket(basics.get_bucket(names.bucket))
+        # Unlike a table, a log group can be deleted and created again in no time, and this drops all its streams.
+        basics.delete_log_group(names.log_group)
+        basics.create_log_group(names.log_group)
+        self._set_state(basics, set_id, _AVAILABLE, _IN_USE)
+        print(f"Returned resource set {set_id} to the pool")
+
+    def _start(self, target, *args):
+        thread = Thread(target=target, args=args)
+        thread.start()
+        self._threads.append(thread)
+
+    # Tops up the pool to its target size, creating the missing sets concurrently in the background.
+    def replenish(self):
+        for _ in range(self._get_shortfall()):
+            self._start(self._create_set)
+
+    # Resets the set and returns it to the pool in the background.
+    def give_back(self, set_id):
+        self._start(self._reset, set_id)
+
+    def wait(self):
+        for thread in self._threads:
+            thread.join()
+        self._threads.clear()
@@ -0,0 +1,73 @@
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from boto_basics import BotoBasics
+from frame_uploader import SHA256_METADATA
+
+_CHUNK_SIZE = 1024 * 1024
+
+# The number of attempts made to download a file whose content doesn't match the hash recorded by the worker.
+_MAX_ATTEMPTS = 3
+
+
+# Downloads rendered frames while the job is still running, rather than all at the end, on a bounded pool of threads
+# that share a single S3 client and its pool of connections. `poll` should be called whenever more frames have been
+# completed - it lists the frames uploaded so far and starts downloading any that are new.
+class ResultDownloader:
+    def __init__(self, basics: BotoBasics, bucket_name, remote_dir, output_dir, max_workers=16):
+        self._basics = basics
+        self._bucket_name = bucket_name
+        self._remote_dir = remote_dir
+        self.output_dir = output_dir
+        self._client = basics.create_s3_client(max_pool_connections=max_workers)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._futures = {}
+        self._skipped = 0
+
+    def _get_filename(self, key):
+        return os.path.join(self.output_dir, key.split("/")[-1])
+
+    # The file is downloaded to a temporary name, and hashed as it's written, so that a partially downloaded, or
+    # corrupt, file is never mistaken for a complete one.
+    def _download(self, key):
+        filename = self._get_filename(key)
+        part_file = f"{filename}.part"
+        for attempt in range(_MAX_ATTEMPTS):
+            response = self._client.get_object(Bucket=self._bucket_name, Key=key)
+            sha256 = hashlib.sha256()
+            with open(part_file, "wb") as f:
+                for chunk in response["Body"].iter_chunks(_CHUNK_SIZE):
+                    sha256.update(chunk)
+                    f.write(chunk)
+            expected = response["Metadata"].get(SHA256_METADATA)
+            if expected is None or expected == sha256.hexdigest():
+                os.replace(part_file, filename)
+                return
+            print(f"Error: {key} doesn't match its hash (attempt {attempt + 1} of {_MAX_ATTEMPTS})")
+        os.unlink(part_file)
+        raise RuntimeError(f"failed to download an intact copy of {key}")
+
+    # Files already present locally, with the expected size, are skipped, e.g. when resuming an interrupted download.
+    def poll(self):
+        sizes = self._basics.list_object_sizes(self._bucket_name, self._remote_dir)
+        for key, size in sizes.items():
+            if key in self._futures:
+                continue
+            filename = self._get_filename(key)
+            if os.path.isfile(filename) and os.path.getsize(filename) == size:
+                self._futures[key] = None
+                self._skipped += 1
+            else:
+                self._futures[key] = self._executor.submit(self._download, key)
+
+    # Downloads any remaining files, waits for all the downloads to complete and returns the number of files.
+    def finish(self):
+        self.poll()
+        self._executor.shutdown(wait=True)
+        for future in self._futures.values():
+            if future is not None:
+                future.result()
+        if self._skipped != 0:
+            print(f"Skipped {self._skipped} files that had already been downloaded")
+        return len(self._futures)
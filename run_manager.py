@@ -1,106 +1,264 @@
-import os.path
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from uuid import uuid4
 
 from boto_basics import BotoBasics, report_non_terminated_instances
+from bootstrap_bundle import get_bootstrap_bundle
 from ec2_instances import create_instances, monitor_and_terminate
+from frame_costs import estimate_frame_costs, MakespanTracker, report_makespan
 from job_steps import (
-    create_worker_files,
+    create_user_data,
+    create_start_job,
     upload_worker_files,
     create_db_table,
+    create_result_downloader,
     download_results,
     USER_DATA,
     delete_temporary_files,
 )
+from fleet_controller import FleetController
+from instance_selection import rank_placements, record_frames_per_hour
+from frames_table import FramesTable
 from names import Names
-from pack import pack_blend_file
+from pack import get_packed_blend_file, PACKED_BLEND_FILE
+from resource_pool import ResourcePool
 from settings import frames_str, get_settings
-from utils import sizeof_fmt
-
-PACKED_BLEND_FILE = "packed.blend"
+from setup_pipeline import SetupPipeline
+from straggler_speculator import StragglerSpeculator
+from tiles import get_items, get_item_costs
 
 basics = BotoBasics()
 job_id = uuid4()
-names = Names(job_id)
 
 
-def confirm(settings, clean_up):
+def confirm(settings):
     print(
         f"instance count = {settings.instance_count}, .blend file = {settings.blend_file}, "
         f"{frames_str(settings.frames)}, file_format = {settings.file_format}, samples = {settings.samples} and motion_blur = {settings.motion_blur}"
     )
-    if settings.interactive and input("Launch workers? [y/N] ") != "y":
-        if input("Clean up? [Y/n] ") != "n":
-            clean_up()
-        sys.exit(0)
+    if not settings.interactive or input("Launch workers? [y/N] ") == "y":
+        return True
+    # E.g. to run the worker locally, as described in the README.
+    if input("Set up the job anyway? [y/N] ") == "y":
+        return False
+    # Nothing has been created yet, other than local files, so there's nothing else to clean up.
+    delete_temporary_files()
+    sys.exit(0)
 
 
-def main():
-    settings = get_settings()
+# The instance types and availability zones are ranked afresh for each launch, as spot prices change.
+def launch_instances(settings, names, count):
+    basics = BotoBasics()
+    placements = rank_placements(basics, settings.blend_file, settings.instance_types, settings.availability_zones)
+    return create_instances(
+        basics,
+        count,
+        names.worker,
+        settings.image_name_pattern,
+        settings.image_owner,
+        placements,
+        settings.security_group_name,
+        settings.key_name,
+        settings.iam_instance_profile,
+        USER_DATA
+    )
+
+
+# Most of the setup steps don't depend on each other, so they're run concurrently. Instances are launched once the
+# slow steps - building the bootstrap bundle, packing the .blend file and estimating the frame costs - are done, as
+# workers only wait so long for the job files, log group and table before giving up and powering off. The remaining
+# steps take seconds, so they're done while the instances boot. Each step uses its own `BotoBasics` as boto3
+# resources aren't thread safe. If the log group, bucket and table come from the resource pool, they already exist
+# and the table just has to be populated.
+def create_setup_pipeline(settings, resources_id, pooled, launch):
+    names = Names(resources_id)
+    pipeline = SetupPipeline()
+
+    def create_log_group():
+        BotoBasics().create_log_group(names.log_group)
+        print(f"Created log group {names.log_group}")
+        # Log output is tailed elsewhere by `LogsRetriever` but you can also tail it with:
+        # $ aws logs tail <log-group-name> --follow'
+
+    def estimate_costs():
+        if settings.estimate_every is None:
+            return None
+        costs = estimate_frame_costs(
+            settings.blender,
+            settings.blend_file,
+            settings.frames,
+            settings.estimate_every,
+            settings.motion_blur
+        )
+        # With tiles, each tile gets an equal share of its frame's cost.
+        return get_item_costs(costs, settings.tiles)
 
-    basics.create_log_group(names.log_group)
-    print(f"Created log group {names.log_group}")
-    # Log output is tailed elsewhere by `LogsRetriever` but you can also tail it with:
-    # $ aws logs tail <log-group-name> --follow'
+    def create_table(costs):
+        # With tiles, each tile is a separate item in the table.
+        items = get_items(settings.frames, settings.tiles)
+        return create_db_table(BotoBasics(), names.dynamodb, items, settings.shards, costs, exists=pooled)
 
-    create_worker_files(
-        job_id,
-        names.bucket,
+    def get_bucket():
+        basics = BotoBasics()
+        return basics.get_bucket(names.bucket) if pooled else basics.create_bucket(names.bucket)
+
+    if not pooled:
+        pipeline.add("log_group", create_log_group)
+    pipeline.add("user_data", lambda: create_user_data(names.bucket))
+    # Blender and the worker's Python packages are fetched by the workers as a single ready-to-use bundle.
+    pipeline.add("bootstrap_bundle", lambda: get_bootstrap_bundle(
+        BotoBasics(),
         settings.file_store,
         settings.blender_archive,
+        settings.worker_python_version
+    ))
+    # The workers fetch the packed .blend file from the file store, where it's only stored once for any given scene.
+    pipeline.add("packed_blend", lambda: get_packed_blend_file(
+        BotoBasics(),
+        settings.blender,
+        settings.blend_file,
+        settings.dependencies,
+        settings.file_store,
+        PACKED_BLEND_FILE
+    ))
+    # The workers find the job's resources via the ID that they're named after.
+    pipeline.add("start_job", lambda bootstrap_bundle, packed_blend: create_start_job(
+        resources_id,
+        settings.file_store,
+        bootstrap_bundle,
+        packed_blend,
         settings.samples,
-        settings.motion_blur
-    )
+        settings.motion_blur,
+        settings.claim_batch,
+        settings.shards,
+        settings.tiles
+    ), ["bootstrap_bundle", "packed_blend"])
+    pipeline.add("bucket", get_bucket)
+    pipeline.add("upload", lambda bucket, _: upload_worker_files(bucket), ["bucket", "start_job"])
+    pipeline.add("costs", estimate_costs)
+    pipeline.add("table", create_table, ["costs"])
+    if launch:
+        pipeline.add(
+            "instances",
+            lambda *_: launch_instances(settings, names, settings.instance_count),
+            ["user_data", "start_job", "costs"]
+        )
+
+    return pipeline
 
-    pack_blend_file(settings.blender, settings.blend_file, PACKED_BLEND_FILE)
-    size = sizeof_fmt(os.path.getsize(PACKED_BLEND_FILE))
-    print(f"Packed the .blend file to {size} (compressed)")
 
-    bucket = basics.create_bucket(names.bucket)
-    upload_worker_files(bucket)
+def _delete_log_group(names):
+    BotoBasics().delete_log_group(names.log_group)
 
-    table = create_db_table(basics, names.dynamodb, settings.frames)
 
-    def clean_up():
-        basics.delete_log_group(names.log_group)
-        basics.delete_bucket(bucket)
-        table.delete()
-        print("Deleted log group, bucket and table")
-        delete_temporary_files()
+def _delete_bucket(names):
+    basics = BotoBasics()
+    basics.delete_bucket(basics.get_bucket(names.bucket))
 
-    confirm(settings, clean_up)
 
-    instance_ids, availability_zone = create_instances(
+def _delete_table(names):
+    FramesTable(BotoBasics(), names.dynamodb).delete()
+
+
+# A pooled set of resources is reset, and returned to the pool, in the background. Otherwise, whatever the setup
+# pipeline managed to create is deleted, with the deletions run concurrently as deleting a table can take 20s.
+def clean_up(resources_id, results, pool, pooled):
+    names = Names(resources_id)
+    if pooled:
+        pool.give_back(resources_id)
+    else:
+        deletions = [(step, f) for step, f in [
+            ("log_group", _delete_log_group),
+            ("bucket", _delete_bucket),
+            ("table", _delete_table)
+        ] if step in results]
+        with ThreadPoolExecutor(max_workers=len(deletions) + 1) as executor:
+            for future in [executor.submit(f, names) for _, f in deletions]:
+                future.result()
+        print(f"Deleted {', '.join(step for step, _ in deletions)}")
+    delete_temporary_files()
+
+
+def main():
+    settings = get_settings()
+
+    launch = confirm(settings)
+
+    # See `resource_pool.py` - the pool is topped up in the background while the job is set up and run.
+    pool = ResourcePool(settings.pool_size) if settings.pool_size > 0 else None
+    set_id = pool.check_out(job_id) if pool is not None else None
+    if pool is not None:
+        pool.replenish()
+    # If the pool is empty, or disabled, the job's resources are created from scratch and deleted afterwards.
+    pooled = set_id is not None
+    resources_id = set_id if pooled else job_id
+    names = Names(resources_id)
+
+    pipeline = create_setup_pipeline(settings, resources_id, pooled, launch)
+    try:
+        pipeline.run()
+    except Exception:
+        if "instances" in pipeline.results:
+            instance_ids = list(pipeline.results["instances"])
+            basics.terminate_instances(instance_ids)
+            print(f"Terminated {len(instance_ids)} instances as the job setup failed")
+        clean_up(resources_id, pipeline.results, pool, pooled)
+        raise
+    pipeline.print_timeline()
+
+    if not launch:
+        sys.exit(0)
+
+    instances = pipeline.results["instances"]
+    bucket = pipeline.results["bucket"]
+    costs = pipeline.results["costs"]
+    # The table created by the pipeline belongs to its thread. The monitor polls the progress on a thread of its own,
+    # so it gets its own `FramesTable`, while the fleet controller etc. use `table` on this thread.
+    table = FramesTable(basics, names.dynamodb, shards=settings.shards)
+    progress_table = FramesTable(BotoBasics(basics.api_calls), names.dynamodb, shards=settings.shards)
+    tracker = MakespanTracker(progress_table.get_progress)
+    downloader = create_result_downloader(basics, job_id, bucket, "frames")
+    # Lost instances are replaced, but no more than the original number of instances are launched as replacements.
+    fleet = FleetController(
         basics,
+        table,
         settings.instance_count,
-        names.worker,
-        settings.image_name_pattern,
-        settings.image_owner,
-        settings.instance_type,
-        settings.security_group_name,
-        settings.key_name,
-        settings.iam_instance_profile,
-        USER_DATA
+        lambda count: launch_instances(settings, names, count),
+        max_launches=settings.instance_count,
+        spare_count=StragglerSpeculator.SPARE_INSTANCES
     )
-    monitor_and_terminate(
+    fleet.add_instances(instances)
+
+    frames_per_hour = monitor_and_terminate(
         basics,
         names.log_group,
-        settings.instance_type,
-        instance_ids,
-        availability_zone,
-        is_finished=lambda: table.get_remaining() == 0
+        instances,
+        get_progress=tracker.get_progress,
+        samples=settings.samples,
+        on_completed=downloader.poll,
+        fleet=fleet,
+        speculator=StragglerSpeculator(table)
     )
+    # Used to rank the instance types the next time this .blend file is rendered.
+    record_frames_per_hour(settings.blend_file, frames_per_hour)
 
-    count = download_results(basics, job_id, bucket, "frames")
+    if costs is not None:
+        report_makespan(costs, settings.instance_count, tracker)
+
+    count = download_results(downloader, settings.blender, settings.tiles)
     if count != len(settings.frames):
         print(f"Error: expected {len(settings.frames)} frames but downloaded {count}")
 
-    clean_up()
+    clean_up(resources_id, pipeline.results, pool, pooled)
     print("Job completed")
 
     # Reassure that there are no unexpected outstanding instances.
     report_non_terminated_instances(basics)
 
+    if pool is not None:
+        print("Waiting for the resource pool to be topped up...")
+        pool.wait()
+
 
 if __name__ == "__main__":
     main()
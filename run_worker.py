@@ -1,16 +1,32 @@
 import argparse
 import os
 import traceback
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from time import sleep, time
+from timeit import default_timer as timer
 
-from boto_basics import BotoBasics, get_s3_uri
+from boto_basics import BotoBasics
 from cloud_watch_logger import CloudWatchLogger
 from ec2_metadata import get_instance_id
-from frames_table import FramesTable
+from frame_uploader import FrameUploader
+from frames_table import FramesTable, LeaseKeeper, get_call_stats
 from names import Names
-from render import render_blend_file_frame
+from render import FrameRenderer, RenderAborted, RenderCancelled
+from render_progress import ProgressReporter
+from render_slots import RenderSlot, detect_render_slots
+from spot_interruption import SpotInterruptionWatcher
+from tiles import decode_item, get_tile_border, get_tile_filename
+from timings import PhaseTimings
 
 PACKED_BLEND_FILE = "packed.blend"
 
+# Written by `user_data` and `start_job` - each line is the name of a step and the time at which it completed.
+_BOOT_TIMELINE = "boot_timeline"
+
+_LOG_GROUP_TIMEOUT = 600
+_LOG_GROUP_POLLING_INTERVAL = 5
+
 basics = BotoBasics()
 
 
@@ -19,6 +35,12 @@ def parse_args():
     parser.add_argument("--blender-home", default="blender", help="root directory of Blender installation")
     parser.add_argument("--samples", required=True, help="number of samples to render for each picture")
     parser.add_argument("--render-job-id", required=True, help="render job UUID")
+    parser.add_argument(
+        "--claim-batch", default="1",
+        help="number of frames to claim at once or 'auto' to adapt the number to the time taken to render a frame"
+    )
+    parser.add_argument("--shards", type=int, default=1, help="number of shards in the frames table")
+    parser.add_argument("--tiles", type=int, default=1, help="render each frame as an N by N grid of tiles")
 
     motion_blur_parser = parser.add_mutually_exclusive_group(required=False)
     motion_blur_parser.add_argument("--enable-motion-blur", dest="motion_blur", action="store_true")
@@ -29,53 +51,168 @@ def parse_args():
     blender = f"{args.blender_home}/blender"
     motion_blur = args.motion_blur if args.motion_blur is not None else True
 
-    return blender, args.samples, motion_blur, args.render_job_id
+    return blender, args.samples, motion_blur, args.render_job_id, args.claim_batch, args.shards, args.tiles
+
+
+def _create_frames_table(names, claim_batch, shards, slot: RenderSlot):
+    # Each slot claims frames independently, so each needs its own lease owner.
+    owner = f"{get_instance_id()}/{slot.name}"
+    if claim_batch == "auto":
+        return FramesTable(basics, names.dynamodb, owner, adaptive=True, shards=shards)
+    else:
+        return FramesTable(basics, names.dynamodb, owner, batch_size=int(claim_batch), shards=shards)
+
+
+def _log_exception(logger):
+    # Try to ensure all exceptions are logged otherwise all one sees is the silent shutdown of the instance.
+    exception = traceback.format_exc().encode("unicode_escape").decode()
+    logger.info(exception)
+
+
+# Each render slot, e.g. each GPU, independently claims and renders frames. Returns the number of frames claimed.
+def _render_slot(
+    logger, bucket, names, blender, samples, motion_blur, claim_batch, shards, tiles, watcher, slot: RenderSlot
+):
+    frames_table = _create_frames_table(names, claim_batch, shards, slot)
+
+    # noinspection PyBroadException
+    try:
+        # Blender is started once and then renders every frame claimed by this slot.
+        progress = ProgressReporter(logger, slot.name)
+        with FrameRenderer(
+            blender, PACKED_BLEND_FILE, samples, motion_blur, slot, logger.info, progress.on_progress
+        ) as renderer:
+            watcher.add_renderer(renderer)
+            # The lease on each claimed frame is renewed while Blender is running. If this instance is lost, e.g. due
+            # to a spot interruption, the lease expires and another worker picks up the frame. If the frame being
+            # rendered is completed by another worker, e.g. because it was re-issued as a straggler, then the render
+            # is cancelled.
+            def cancel(item):
+                renderer.cancel(*_get_frame_and_border(item, tiles))
+
+            with LeaseKeeper(frames_table, logger, cancel):
+                try:
+                    with FrameUploader(basics, logger, bucket, frames_table, slot.name) as uploader:
+                        _render_frames(logger, frames_table, renderer, uploader, tiles, watcher, slot)
+                finally:
+                    # Give back any claimed frames that won't now be rendered by this slot.
+                    frames_table.release_claims()
+    except Exception:
+        # A failing slot shouldn't stop the other slots.
+        _log_exception(logger)
+
+    return frames_table.claimed
 
 
-def render(logger, names, blender, samples, motion_blur):
+def render(logger, names, blender, samples, motion_blur, claim_batch, shards, tiles):
     bucket_name = names.bucket
     bucket = basics.get_bucket(bucket_name)
 
-    db_name = names.dynamodb
-    frames_table = FramesTable(basics, db_name)
+    FramesTable(basics, names.dynamodb, shards=shards).wait_until_ready()
 
-    while True:
-        frame = frames_table.get_frame()
-        if frame is None:
+    slots = detect_render_slots()
+    logger.info(f"rendering with slots {[slot.name for slot in slots]}")
+
+    with SpotInterruptionWatcher(logger) as watcher, ThreadPoolExecutor(max_workers=len(slots)) as executor:
+        futures = [
+            executor.submit(
+                _render_slot,
+                logger, bucket, names, blender, samples, motion_blur, claim_batch, shards, tiles, watcher, slot
+            )
+            for slot in slots
+        ]
+    claimed = sum(future.result() for future in futures)
+
+    logger.info(get_call_stats(basics, claimed))
+
+
+# In tile mode, the items in the frames table are tiles and only the tile's border is rendered.
+def _get_frame_and_border(item, tiles):
+    frame, tile = decode_item(item, tiles)
+    return frame, get_tile_border(tile, tiles) if tiles != 1 else None
+
+
+# Each frame is handed off to the uploader, so the next frame can be rendered while the previous one is uploaded.
+# In tile mode, the items in the frames table are tiles rather than whole frames. The time taken by each phase, from
+# claiming a frame to completing it, is logged once the frame is completed. On a spot interruption, the claims are
+# released straight away, apart from those of frames that are being uploaded, which will hopefully complete in time.
+def _render_frames(logger, frames_table, renderer, uploader, tiles, watcher, slot: RenderSlot):
+    while not watcher.interrupted.is_set():
+        timings = PhaseTimings()
+        with timings.phase("claim"):
+            item = frames_table.get_frame()
+        if item is None or watcher.interrupted.is_set():
             break
-        logger.info(f"rendering frame {frame}")
-        output_file = render_blend_file_frame(blender, PACKED_BLEND_FILE, samples, motion_blur, frame)
-        basename = os.path.basename(output_file)
-        s3_output_file = bucket.Object(f"frames/{basename}")
-        if basics.object_exists(s3_output_file):
-            # Skip upload if another worker already beat us to it.
-            logger.info(f"completed frame {frame} but skipped upload")
+        frame, tile = decode_item(item, tiles)
+        if tiles == 1:
+            logger.info(f"rendering frame {frame} on {slot.name}")
         else:
-            s3_output_file.upload_file(output_file)
-            logger.info(f"completed and uploaded {get_s3_uri(s3_output_file)}")
-        os.unlink(output_file)
-        frames_table.delete_frame(frame)
+            logger.info(f"rendering frame {frame} tile {tile} on {slot.name}")
+        _, border = _get_frame_and_border(item, tiles)
+        frames_table.start_frame(item)
+        start = timer()
+        try:
+            output_file = renderer.render(frame, timings, border)
+        except RenderCancelled:
+            continue
+        except RenderAborted:
+            break
+        render_time = timer() - start
+        frames_table.record_render_time(render_time)
+        filename = os.path.basename(output_file)
+        if tiles != 1:
+            filename = get_tile_filename(filename, tile)
+        uploader.submit(item, output_file, render_time, filename, timings)
+
+    if watcher.interrupted.is_set():
+        frames_table.release_claims(keep=uploader.pending)
+        logger.info(f"released claims on {slot.name} due to the spot interruption")
+
+
+# Log how long each step, from the kernel booting to this script starting, took. The time taken to start Blender,
+# and load the .blend file, is included in the timings logged for each slot's first frame.
+def _log_boot_timeline(logger):
+    path = Path(_BOOT_TIMELINE)
+    if not path.is_file():
+        # E.g. when running locally.
+        return
+    steps = [line.split() for line in path.read_text().splitlines()]
+    steps = [(name, float(seconds)) for name, seconds in steps] + [("worker_started", time())]
+    durations = [f"{name} +{seconds - prev:.1f}s" for (_, prev), (name, seconds) in zip(steps, steps[1:])]
+    logger.info(f"boot timeline: {', '.join(durations)} (total {steps[-1][1] - steps[0][1]:.1f}s)")
+
+
+# The manager may still be creating the log group when the worker starts.
+def _create_log_stream(group_name, stream_name):
+    deadline = time() + _LOG_GROUP_TIMEOUT
+    while True:
+        try:
+            basics.create_log_stream(group_name, stream_name)
+            return
+        except basics.logs_exceptions.ResourceNotFoundException:
+            if time() > deadline:
+                raise
+            sleep(_LOG_GROUP_POLLING_INTERVAL)
 
 
 def main():
-    blender, samples, motion_blur, job_id = parse_args()
+    blender, samples, motion_blur, job_id, claim_batch, shards, tiles = parse_args()
 
     names = Names(job_id)
 
     group_name = names.log_group
     stream_name = get_instance_id()
-    basics.create_log_stream(group_name, stream_name)
+    _create_log_stream(group_name, stream_name)
     logger = CloudWatchLogger(basics, group_name, stream_name)
 
     logger.info("job started")
+    _log_boot_timeline(logger)
 
     # noinspection PyBroadException
     try:
-        render(logger, names, blender, samples, motion_blur)
+        render(logger, names, blender, samples, motion_blur, claim_batch, shards, tiles)
     except Exception:
-        # Try to ensure all exceptions are logged otherwise all one sees is the silent shutdown of the instance.
-        exception = traceback.format_exc().encode("unicode_escape").decode()
-        logger.info(exception)
+        _log_exception(logger)
 
     logger.info("exiting")
 
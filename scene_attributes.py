@@ -1,12 +1,28 @@
+import textwrap
+from pathlib import Path
+
+from blend_cache import get_cached, set_cached
 from blender import run_blender, dump_dict, recover_dict
+from pack import get_pack_code
+
+
+# Starting Blender, and loading a big .blend file, can take tens of seconds, so everything needed from the .blend
+# file is done in a single session. The scene attributes are returned along with the absolute paths of all the
+# external files, e.g. textures, that the .blend file depends on. And the .blend file is packed to `packed_file`.
+#
+# The results are cached by the .blend file's hash, so an unchanged .blend file doesn't need Blender at all. In that
+# case, the .blend file is not packed, i.e. `packed_file` won't exist. If you just want the start and end frames,
+# `blend_info.py` can read them without Blender.
+def get_scene_attributes(blender, input_file, packed_file):
+    # Make sure an old packed file, e.g. from an earlier failed job, can't be mistaken for the current one.
+    packed_file = Path(packed_file).absolute()
+    packed_file.unlink(missing_ok=True)
 
+    attributes = get_cached(input_file, "attributes")
+    if attributes is not None:
+        return attributes
 
-# You can actually get the start and end frames without starting Blender itself using:
-#  https://github.com/dfelinto/blender/blob/master/release/scripts/modules/blend_render_info.py
-# Just run `python3 blend_render_info.py blend-file.blend` - it doesn't need any additional libraries.
-# However, it's limited to just that information.
-def get_scene_attributes(blender, input_file):
-    code = f"""
+    code = textwrap.dedent(f"""
         import bpy
 
         scene = bpy.context.scene
@@ -18,9 +34,12 @@ def get_scene_attributes(blender, input_file):
             "samples": scene.cycles.samples,
             "motion_blur": scene.render.use_motion_blur,
             "is_movie_format": scene.render.is_movie_format,
-            "file_format": scene.render.image_settings.file_format
+            "file_format": scene.render.image_settings.file_format,
+            "dependencies": sorted(bpy.utils.blend_paths(absolute=True))
         }}
 
         {dump_dict("attributes")}
-    """
-    return recover_dict(run_blender(blender, input_file, code, capture_output=True))
+    """) + get_pack_code(packed_file)
+    attributes = recover_dict(run_blender(blender, input_file, code, capture_output=True))
+    set_cached(input_file, "attributes", attributes)
+    return attributes
@@ -4,14 +4,18 @@ from collections import namedtuple
 
 from boto_basics import BotoBasics, get_s3_uri
 from config import get_config
+from frames_table import FramesTable
+from pack import PACKED_BLEND_FILE
 from scene_attributes import get_scene_attributes
+from tiles import STITCHABLE_FORMATS, get_tile_count
 
 
 basics = BotoBasics()
 
 Settings = namedtuple("Settings", [
     "instance_count",
-    "instance_type",
+    "instance_types",
+    "availability_zones",
     "image_name_pattern",
     "image_owner",
     "security_group_name",
@@ -20,11 +24,18 @@ Settings = namedtuple("Settings", [
     "blender",
     "file_store",
     "blender_archive",
+    "worker_python_version",
     "blend_file",
+    "dependencies",
     "frames",
     "file_format",
     "samples",
     "motion_blur",
+    "claim_batch",
+    "shards",
+    "estimate_every",
+    "tiles",
+    "pool_size",
     "interactive"
 ])
 
@@ -39,6 +50,15 @@ def _parse_args():
     parser.add_argument("--frames", help="comma separated list of frame numbers")
     parser.add_argument("--samples", type=int, help="number of samples to render for each pixel")
     parser.add_argument("--ec2-instances", type=int, dest="instance_count", help="number of EC2 instances to run")
+    parser.add_argument("--claim-batch", help="number of frames a worker claims at once or 'auto'")
+    parser.add_argument(
+        "--estimate-costs", type=int, dest="estimate_every", metavar="N",
+        help="estimate the cost of each frame from low quality renders of every Nth frame and render the most costly first"
+    )
+    parser.add_argument(
+        "--tiles", type=int, metavar="N",
+        help="split each frame into an N by N grid of tiles that are rendered separately and then stitched together"
+    )
     parser.add_argument(
         "--disable-interactive", help="disable prompting for input",
         dest="interactive", default=True, action="store_false"
@@ -53,6 +73,11 @@ def _parse_args():
     return parser.parse_args()
 
 
+# Returns `None` if `value` is `None`, i.e. the setting isn't present.
+def _split_list(value):
+    return [s.strip() for s in value.split(",")] if value is not None else None
+
+
 # Build setting by combining "settings.ini" and command line arguments.
 def get_settings() -> Settings:
     config = get_config("settings.ini")
@@ -60,13 +85,20 @@ def get_settings() -> Settings:
     blender_home = config.get("blender_home")
     file_store = config.get("file_store")
     blender_archive = config.get("blender_archive")
+    worker_python_version = config.get("worker_python_version")
     instance_count = config.getint("instance_count")
-    instance_type = config.get("instance_type")
+    # A single `instance_type`, as used before a list of types was supported, is still accepted.
+    instance_types = _split_list(config.get("instance_types", config.get("instance_type")))
+    availability_zones = _split_list(config.get("availability_zones"))
     image_name_pattern = config.get("image_name_pattern")
     image_owner = config.get("image_owner")
     security_group_name = config.get("security_group_name")
     key_name = config.get("key_name")
     iam_instance_profile = config.get("iam_instance_profile")
+    claim_batch = config.get("claim_batch", "1")
+    shards = config.getint("shards", 1)
+    tiles = config.getint("tiles", 1)
+    pool_size = config.getint("pool_size", 0)
 
     args = _parse_args()
 
@@ -76,7 +108,8 @@ def get_settings() -> Settings:
     blender = f"{blender_home}/blender"
     blend_file = args.blend_file
 
-    attrs = get_scene_attributes(blender, blend_file)
+    # This also packs the .blend file, if its attributes aren't already cached, to avoid starting Blender twice.
+    attrs = get_scene_attributes(blender, blend_file, PACKED_BLEND_FILE)
 
     samples = attrs["samples"] if args.samples is None else args.samples
 
@@ -125,18 +158,39 @@ def get_settings() -> Settings:
     # `interactive` controls prompting for input. It's not about whether Python was started in interactive (-i) mode.
     interactive = args.interactive if sys.stdin.isatty() else False
 
+    if args.claim_batch is not None:
+        claim_batch = args.claim_batch
+    max_batch = FramesTable.MAX_BATCH_SIZE
+    if claim_batch != "auto" and not (claim_batch.isdigit() and 1 <= int(claim_batch) <= max_batch):
+        sys.exit(f"the claim batch must be a number between 1 and {max_batch} or 'auto' but is {claim_batch}")
+
+    if args.estimate_every is not None and args.estimate_every < 1:
+        sys.exit(f"the --estimate-costs value must be at least 1 but is {args.estimate_every}")
+
+    if args.tiles is not None:
+        tiles = args.tiles
+    if tiles < 1:
+        sys.exit(f"the tile grid size must be at least 1 but is {tiles}")
+    if tiles != 1 and file_format not in STITCHABLE_FORMATS:
+        sys.exit(f"tiles can only be stitched for the formats {STITCHABLE_FORMATS} but the format is {file_format}")
+
+    if not 1 <= shards <= FramesTable.MAX_SHARDS:
+        sys.exit(f"the shard count must be between 1 and {FramesTable.MAX_SHARDS} but is {shards}")
+
     # Override instance count if provided.
     if args.instance_count is not None:
         instance_count = args.instance_count
 
     # There's no point (unless you expect terrible spot instance termination rates) to start more instances than
-    # there are frames to render.
-    if instance_count > len(frames):
-        sys.exit(f"the instance count {instance_count} must be less than or equal to the frame count {len(frames)}")
+    # there are frames (or tiles) to render.
+    item_count = len(frames) * get_tile_count(tiles)
+    if instance_count > item_count:
+        sys.exit(f"the instance count {instance_count} must be less than or equal to the frame and tile count {item_count}")
 
     return Settings(
         instance_count=instance_count,
-        instance_type=instance_type,
+        instance_types=instance_types,
+        availability_zones=availability_zones,
         image_name_pattern=image_name_pattern,
         image_owner=image_owner,
         security_group_name=security_group_name,
@@ -145,11 +199,18 @@ def get_settings() -> Settings:
         blender=blender,
         file_store=file_store,
         blender_archive=blender_archive,
+        worker_python_version=worker_python_version,
         blend_file=blend_file,
+        dependencies=attrs["dependencies"],
         frames=frames,
         file_format=file_format,
         samples=samples,
         motion_blur=motion_blur,
+        claim_batch=claim_batch,
+        shards=shards,
+        estimate_every=args.estimate_every,
+        tiles=tiles,
+        pool_size=pool_size,
         interactive=interactive
     )
 
@@ -0,0 +1,75 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from timeit import default_timer as timer
+
+_Step = namedtuple("_Step", ["name", "function", "dependencies"])
+
+
+# Runs the steps involved in setting up a job concurrently, each as soon as the steps it depends on have completed.
+# Each step's function is called with the results of its dependencies, in the order they were given. Steps must be
+# added after the steps they depend on, so there can't be cycles.
+class SetupPipeline:
+    def __init__(self):
+        self._steps = {}
+        self._times = {}
+        self._origin = None
+        self.results = {}
+
+    def add(self, name, function, dependencies=()):
+        for dependency in dependencies:
+            if dependency not in self._steps:
+                raise RuntimeError(f"step {name} depends on unknown step {dependency}")
+        self._steps[name] = _Step(name, function, list(dependencies))
+
+    def _run_step(self, step):
+        start = timer()
+        try:
+            return step.function(*[self.results[dependency] for dependency in step.dependencies])
+        finally:
+            self._times[step.name] = (start - self._origin, timer() - self._origin)
+
+    # If a step fails, no further steps are started and, once the running steps have completed, the failure is
+    # raised. `results` then holds the results of the steps that did complete, e.g. so they can be cleaned up.
+    def run(self):
+        self._origin = timer()
+        pending = dict(self._steps)
+        running = {}
+        failure = None
+        with ThreadPoolExecutor(max_workers=len(self._steps)) as executor:
+            while True:
+                if failure is None:
+                    ready = [s for s in pending.values() if all(d in self.results for d in s.dependencies)]
+                    for step in ready:
+                        del pending[step.name]
+                        running[executor.submit(self._run_step, step)] = step.name
+                if len(running) == 0:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        self.results[name] = future.result()
+                    except Exception as e:
+                        failure = failure if failure is not None else e
+        if failure is not None:
+            raise failure
+
+    # Working back from the step that finished last, the critical path follows, at each step, the dependency that
+    # finished last, i.e. the one that the step was actually waiting on.
+    def _get_critical_path(self):
+        name = max(self._times, key=lambda n: self._times[n][1])
+        path = [name]
+        while len(self._steps[name].dependencies) != 0:
+            name = max(self._steps[name].dependencies, key=lambda n: self._times[n][1])
+            path.append(name)
+        return list(reversed(path))
+
+    # Prints when each step started and ended, relative to the start of the pipeline, with the steps on the
+    # critical path marked with a '*'.
+    def print_timeline(self):
+        critical_path = self._get_critical_path()
+        print("Setup timeline (* marks the critical path):")
+        for name, (start, end) in sorted(self._times.items(), key=lambda item: item[1]):
+            marker = "*" if name in critical_path else " "
+            print(f"{marker} {start:6.1f}s - {end:6.1f}s {name} ({end - start:.1f}s)")
+        print(f"Critical path: {' -> '.join(critical_path)}")
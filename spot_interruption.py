@@ -0,0 +1,63 @@
+from threading import Event, Lock, Thread
+
+from ec2_metadata import get_spot_interruption, is_metadata_service_available
+from render import FrameRenderer
+
+
+# AWS gives two minutes notice before it interrupts a spot instance. Rather than just disappearing mid-frame, and the
+# frame only being picked up by another worker once its lease expires, the worker polls for the notice and, when it
+# comes, aborts its renders so that its claims can be released straight away.
+class SpotInterruptionWatcher:
+    # AWS recommends checking for the notice every 5s.
+    POLLING_INTERVAL = 5
+
+    def __init__(self, logger):
+        self._logger = logger
+        self._renderers = []
+        self._lock = Lock()
+        self._stopped = Event()
+        self._failing = False
+        self._thread = Thread(target=self._run, daemon=True)
+        self.interrupted = Event()
+
+    # A renderer that's added after the notice has arrived is aborted immediately.
+    def add_renderer(self, renderer: FrameRenderer):
+        with self._lock:
+            self._renderers.append(renderer)
+            interrupted = self.interrupted.is_set()
+        if interrupted:
+            renderer.abort()
+
+    def _check(self):
+        try:
+            notice = get_spot_interruption()
+        except OSError as e:
+            # Only log the first of a run of failures.
+            if not self._failing:
+                self._logger.info(f"failed to check for a spot interruption notice - {e}")
+            self._failing = True
+            return False
+        self._failing = False
+        if notice is None:
+            return False
+        self._logger.info(f"received spot interruption notice - {notice['action']} at {notice['time']}")
+        with self._lock:
+            self.interrupted.set()
+            renderers = list(self._renderers)
+        for renderer in renderers:
+            renderer.abort()
+        return True
+
+    def _run(self):
+        while not self._stopped.wait(self.POLLING_INTERVAL):
+            if self._check():
+                return
+
+    # When running locally, there's no metadata service to poll (unless `fake_metadata_server.py` is used).
+    def __enter__(self):
+        if is_metadata_service_available():
+            self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stopped.set()
@@ -0,0 +1,40 @@
+from time import time
+
+from frames_table import FramesTable, Progress
+from timings import TimingsAggregator
+
+
+# Near the end of a job, the workers that have run out of frames sit idle while the last few frames are rendered. If
+# one of those frames is taking far longer than is typical, e.g. because it landed on a slow or struggling instance,
+# it holds up the whole job. Such stragglers are re-issued, so an idle worker can render them too. The first worker to
+# finish completes the frame and the others cancel their renders (see `LeaseKeeper`).
+class StragglerSpeculator:
+    # The number of idle instances to keep around to pick up re-issued frames (see `FleetController`).
+    SPARE_INSTANCES = 1
+
+    # A frame is a straggler once it has been rendering for this many times the median render time.
+    _SLOWDOWN = 3
+
+    # The median isn't trusted until this many frames have been rendered.
+    _MIN_SAMPLES = 5
+
+    def __init__(self, frames_table: FramesTable):
+        self._frames_table = frames_table
+
+    def update(self, progress: Progress, timings: TimingsAggregator):
+        # Only once no frames are left to claim are there workers that could pick up the re-issued frames.
+        if progress.remaining == 0 or progress.remaining != progress.claimed:
+            return
+        median_seconds = timings.get_median_render_seconds(self._MIN_SAMPLES)
+        if median_seconds is None:
+            return
+        cutoff = time() - self._SLOWDOWN * median_seconds
+        stragglers = [
+            lease for lease in self._frames_table.get_leases()
+            if "speculated" not in lease and "started" in lease and lease["started"] < cutoff
+        ]
+        if len(stragglers) == 0:
+            return
+        frames = self._frames_table.speculate(stragglers)
+        if len(frames) != 0:
+            print(f"Re-issued straggling frames {frames} (the median render time is {median_seconds:.0f}s)")
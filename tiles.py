@@ -0,0 +1,127 @@
+import os
+import re
+from collections import defaultdict
+
+from blender import run_blender
+
+# In tile mode, each frame is split into a `grid` by `grid` arrangement of tiles and each tile is a separate work
+# item in the frames table. A work item number encodes both the frame and the tile, such that, with a grid of 1,
+# the item number is just the frame number.
+
+# Tiles are stitched with Blender's own image handling, which only supports these formats as single layer images.
+STITCHABLE_FORMATS = ["PNG", "OPEN_EXR"]
+
+_TILE_MATCHER = re.compile(r"^(.*)-tile-(\d+)(\.[^.]+)$")
+
+
+def get_tile_count(grid):
+    return grid * grid
+
+
+def encode_item(frame, tile, grid):
+    return frame * get_tile_count(grid) + tile
+
+
+# Returns the frame and tile encoded by `encode_item`. `divmod` rounds down, so this works for negative frames too.
+def decode_item(item, grid):
+    return divmod(item, get_tile_count(grid))
+
+
+def get_items(frames, grid):
+    return [encode_item(frame, tile, grid) for frame in frames for tile in range(get_tile_count(grid))]
+
+
+# Every tile costs the same fraction of its frame's cost.
+def get_item_costs(costs, grid):
+    tile_count = get_tile_count(grid)
+    return {
+        encode_item(frame, tile, grid): cost / tile_count
+        for frame, cost in costs.items()
+        for tile in range(tile_count)
+    }
+
+
+# Returns the region of the frame covered by the tile, as fractions of the frame size, in the order used by
+# Blender's `border_min_x`, `border_max_x`, `border_min_y` and `border_max_y`. Tile 0 is in the bottom left corner.
+def get_tile_border(tile, grid):
+    row, column = divmod(tile, grid)
+    return [column / grid, (column + 1) / grid, row / grid, (row + 1) / grid]
+
+
+# E.g. "frame-0012.png" becomes "frame-0012-tile-3.png".
+def get_tile_filename(filename, tile):
+    base, ext = os.path.splitext(filename)
+    return f"{base}-tile-{tile}{ext}"
+
+
+# Groups tile files by the name of the frame they belong to. Files that aren't tiles are ignored.
+def _group_tile_files(filenames):
+    groups = defaultdict(dict)
+    for filename in filenames:
+        match = _TILE_MATCHER.match(os.path.basename(filename))
+        if match is not None:
+            frame_filename = os.path.join(os.path.dirname(filename), match.group(1) + match.group(3))
+            groups[frame_filename][int(match.group(2))] = filename
+    return groups
+
+
+# Each tile is the cropped result of a border render, so tiles in the same column share a width and tiles in the
+# same row share a height. Rather than repeating Blender's rounding of the border to pixels, the offset of each
+# tile is worked out from the sizes of the tiles before it. Image pixels start in the bottom left corner, like
+# the tiles, and are floats whatever the underlying format.
+def _get_stitch_python_expr(grid, frames):
+    return f"""
+        import bpy
+        import numpy as np
+
+        grid = {grid}
+        for output_file, tile_files in {frames}:
+            tiles = [bpy.data.images.load(tile_file) for tile_file in tile_files]
+            widths = [tile.size[0] for tile in tiles[:grid]]
+            heights = [tile.size[1] for tile in tiles[::grid]]
+            pixels = np.zeros((sum(heights), sum(widths), 4), dtype=np.float32)
+            for i, tile in enumerate(tiles):
+                row, column = divmod(i, grid)
+                x, y = sum(widths[:column]), sum(heights[:row])
+                width, height = tile.size
+                tile_pixels = np.empty(width * height * 4, dtype=np.float32)
+                tile.pixels.foreach_get(tile_pixels)
+                pixels[y:y + height, x:x + width] = tile_pixels.reshape(height, width, 4)
+
+            image = bpy.data.images.new(
+                "stitched", pixels.shape[1], pixels.shape[0], alpha=True, float_buffer=tiles[0].is_float
+            )
+            image.pixels.foreach_set(pixels.ravel())
+            image.file_format = tiles[0].file_format
+            image.filepath_raw = output_file
+            image.save()
+            for i in [image] + tiles:
+                bpy.data.images.remove(i)
+    """
+
+
+# Stitches the tiles in `output_dir` into frames, in a single Blender session, and deletes the tiles. Returns the
+# number of frames stitched. Frames with missing tiles are left as they are.
+def stitch_tiles(blender, output_dir, grid):
+    # Blender is given absolute paths as it may not share the current working directory.
+    filenames = [os.path.abspath(os.path.join(output_dir, filename)) for filename in os.listdir(output_dir)]
+    tile_count = get_tile_count(grid)
+    frames = []
+    for frame_filename, tiles in sorted(_group_tile_files(filenames).items()):
+        if len(tiles) != tile_count:
+            print(f"Error: found {len(tiles)} of {tile_count} tiles for {frame_filename}")
+            continue
+        frames.append((frame_filename, [tiles[tile] for tile in range(tile_count)]))
+
+    if len(frames) == 0:
+        return 0
+
+    print(f"Stitching {len(frames)} frames from {tile_count} tiles each")
+    # There's no need for a .blend file, Blender's factory startup scene will do.
+    run_blender(blender, None, _get_stitch_python_expr(grid, frames), capture_output=True)
+
+    for _, tile_files in frames:
+        for tile_file in tile_files:
+            os.unlink(tile_file)
+
+    return len(frames)
@@ -0,0 +1,111 @@
+import json
+import statistics
+from collections import defaultdict
+from contextlib import contextmanager
+from timeit import default_timer as timer
+
+# Workers log the time spent in each phase of rendering a frame as a JSON record that follows this marker. The
+# manager picks these records out of the log events and aggregates them.
+_MARKER = "TIMINGS>"
+
+_PERCENTILES = [50, 90, 99]
+_HISTOGRAM_BUCKETS = 10
+_HISTOGRAM_WIDTH = 40
+
+
+def format_timings(frame, timings):
+    return f"{_MARKER} {json.dumps({'frame': frame, 'timings': timings})}"
+
+
+# Returns `None` if the message isn't a record created by `format_timings`.
+def parse_timings(message):
+    if not message.startswith(_MARKER):
+        return None
+    return json.loads(message[len(_MARKER):])["timings"]
+
+
+# Accumulates the time, in seconds, spent in each phase. The same phase can be timed more than once.
+class PhaseTimings:
+    def __init__(self):
+        self.timings = {}
+
+    def add(self, phase, seconds):
+        self.timings[phase] = self.timings.get(phase, 0) + seconds
+
+    @contextmanager
+    def phase(self, phase):
+        start = timer()
+        try:
+            yield
+        finally:
+            self.add(phase, timer() - start)
+
+
+# Nearest-rank percentile of already sorted values.
+def _percentile(values, p):
+    index = max(0, -(-len(values) * p // 100) - 1)
+    return values[index]
+
+
+def _histogram(values):
+    top = values[-1]
+    width = top / _HISTOGRAM_BUCKETS if top > 0 else 1
+    counts = [0] * _HISTOGRAM_BUCKETS
+    for value in values:
+        counts[min(int(value / width), _HISTOGRAM_BUCKETS - 1)] += 1
+    scale = _HISTOGRAM_WIDTH / max(counts)
+    return [
+        f"  {i * width:8.2f}s - {(i + 1) * width:8.2f}s {count:5} {'#' * round(count * scale)}"
+        for i, count in enumerate(counts)
+    ]
+
+
+# The phases, logged for each frame, that aren't part of rendering the frame.
+_NON_RENDER_PHASES = {"claim", "upload", "complete"}
+
+
+# Returns the time spent rendering a frame given the timings of its phases.
+def get_render_seconds(timings):
+    return sum(seconds for phase, seconds in timings.items() if phase not in _NON_RENDER_PHASES)
+
+
+# Collects the timing records logged by the workers and reports where the time went.
+class TimingsAggregator:
+    def __init__(self):
+        self._values = defaultdict(list)
+        self._render_seconds = []
+
+    # Returns `True` if the message was a timing record.
+    def add(self, message):
+        timings = parse_timings(message)
+        if timings is None:
+            return False
+        for phase, seconds in timings.items():
+            self._values[phase].append(seconds)
+        self._render_seconds.append(get_render_seconds(timings))
+        return True
+
+    # Returns the median time taken to render a frame or `None` if fewer than `min_count` frames have been rendered.
+    def get_median_render_seconds(self, min_count=1):
+        if len(self._render_seconds) < max(min_count, 1):
+            return None
+        return statistics.median(self._render_seconds)
+
+    def report(self):
+        if len(self._values) == 0:
+            print("No phase timings were received from the workers")
+            return
+
+        grand_total = sum(sum(values) for values in self._values.values())
+        print("Time spent per phase (in seconds):")
+        # List the phases that took up the most time first.
+        for phase, values in sorted(self._values.items(), key=lambda item: sum(item[1]), reverse=True):
+            values = sorted(values)
+            total = sum(values)
+            percentiles = ", ".join(f"p{p} {_percentile(values, p):.2f}" for p in _PERCENTILES)
+            print(
+                f"{phase}: count {len(values)}, total {total:.1f} ({total / grand_total:.0%}), "
+                f"mean {total / len(values):.2f}, {percentiles}, max {values[-1]:.2f}"
+            )
+            for line in _histogram(values):
+                print(line)
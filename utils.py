@@ -1,5 +1,8 @@
+import hashlib
 from datetime import timedelta
 
+_CHUNK_SIZE = 1024 * 1024
+
 
 # https://stackoverflow.com/a/1094933/245602
 def sizeof_fmt(num, suffix="B"):
@@ -10,6 +13,14 @@ def sizeof_fmt(num, suffix="B"):
     return f"{num:.1f}Yi{suffix}"
 
 
+def hash_file(filename):
+    sha256 = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
 # The default timedelta.__str__ is hard to read - this is an alternative.
 def timedelta_fmt(td: timedelta):
     # Logic to decompose into hours etc. copied from timedelta.__str__.